@@ -0,0 +1,472 @@
+"""签到插件负载模拟。
+
+在临时目录中生成指定规模的数据集，用桩对象加载 ContractSystem，
+重放典型的指令组合，报告吞吐量、延迟分位数、峰值内存和每条指令的写入字节数。
+头像和背景接口由本地 HTTP 服务代替，群成员接口由假的 aiocqhttp 客户端代替，
+HTML 渲染按 --render-delay 模拟耗时。
+
+用法:
+    python benchmarks/bench_load.py --users 100000 --groups 200
+    python benchmarks/bench_load.py --scenario midnight,trading --backend sqlite
+    python benchmarks/bench_load.py --users 1000000 --groups 2000 --json
+
+场景:
+    midnight     每个被选中的群全员同时签到
+    leaderboard  反复刷排行榜和个人信息
+    trading      群内随机购买、出售、赎身
+    mixed        以上指令按比例混合
+"""
+
+import argparse
+import asyncio
+import importlib
+import io
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "qsign_bench"
+SCENARIOS = ("midnight", "leaderboard", "trading", "mixed")
+
+
+# ---------------------------------------------------------------------------
+# 框架桩对象（仅在未安装 AstrBot 时使用）
+# ---------------------------------------------------------------------------
+
+
+def install_astrbot_stubs(render_delay: float):
+    def module(name: str, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+        return mod
+
+    class Filter:
+        class PermissionType:
+            ADMIN = "admin"
+            MEMBER = "member"
+
+        @staticmethod
+        def _passthrough(*args, **kwargs):
+            return lambda func: func
+
+        regex = command = permission_type = _passthrough
+
+    class At:
+        def __init__(self, qq):
+            self.qq = qq
+
+    class Star:
+        def __init__(self, context):
+            self.context = context
+
+        async def html_render(self, tmpl, data, return_url=True, options=None):
+            await asyncio.sleep(render_delay)
+            return f"http://render.local/{id(data)}.jpg"
+
+    class AiocqhttpMessageEvent:
+        pass
+
+    logger = logging.getLogger("qsign-bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    module("astrbot")
+    module("astrbot.api", logger=logger, AstrBotConfig=dict)
+    module("astrbot.api.event", AstrMessageEvent=object, filter=Filter)
+    module("astrbot.api.message_components", At=At)
+    module(
+        "astrbot.api.star",
+        Context=object,
+        Star=Star,
+        register=lambda *args, **kwargs: lambda cls: cls,
+    )
+    for name in (
+        "astrbot.core",
+        "astrbot.core.platform",
+        "astrbot.core.platform.sources",
+        "astrbot.core.platform.sources.aiocqhttp",
+    ):
+        module(name)
+    module(
+        "astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event",
+        AiocqhttpMessageEvent=AiocqhttpMessageEvent,
+    )
+
+
+def load_plugin_module(name: str = "main"):
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [REPO_DIR]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+# ---------------------------------------------------------------------------
+# 假的消息事件、群成员接口和图片接口
+# ---------------------------------------------------------------------------
+
+
+class FakeApi:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def call_action(self, action: str, **params):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if action == "get_group_member_info":
+            return {"card": f"成员{params['user_id']}"}
+        if action == "get_group_member_list":
+            return [
+                {"user_id": uid, "card": f"成员{uid}"}
+                for uid in GROUP_MEMBERS.get(str(params["group_id"]), ())
+            ]
+        return {}
+
+
+class FakeClient:
+    def __init__(self, latency: float):
+        self.api = FakeApi(latency)
+
+
+GROUP_MEMBERS = {}
+
+
+def make_event_class(base, at_class, client):
+    class BenchMessage:
+        __slots__ = ("group_id", "message")
+
+        def __init__(self, group_id, message):
+            self.group_id = group_id
+            self.message = message
+
+    class BenchEvent(base):
+        bot = client
+
+        def __init__(self, group_id: str, user_id: str, at: str = None):
+            components = [at_class(int(at))] if at else []
+            self.message_obj = BenchMessage(group_id, components)
+            self.user_id = user_id
+
+        def get_sender_id(self):
+            return self.user_id
+
+        def get_sender_name(self):
+            return f"成员{self.user_id}"
+
+        def get_platform_name(self):
+            return "aiocqhttp"
+
+        def plain_result(self, text):
+            return ("plain", text)
+
+        def image_result(self, url):
+            return ("image", url)
+
+    return BenchEvent
+
+
+async def start_image_server(latency: float):
+    from aiohttp import web
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 640), (200, 120, 80)).save(buffer, "JPEG")
+    image = buffer.getvalue()
+
+    async def serve(request):
+        await asyncio.sleep(latency)
+        if request.headers.get("If-None-Match") == '"bench"':
+            return web.Response(status=304)
+        return web.Response(
+            body=image, content_type="image/jpeg", headers={"ETag": '"bench"'}
+        )
+
+    app = web.Application()
+    app.router.add_get("/avatar", serve)
+    app.router.add_get("/bg", serve)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+# ---------------------------------------------------------------------------
+# 数据集
+# ---------------------------------------------------------------------------
+
+
+def generate_dataset(data_dir: str, users: int, groups: int, seed: int) -> dict:
+    """直接写出按群分片的 JSON 快照，返回 {群号: [用户ID, ...]}。"""
+    rng = random.Random(seed)
+    shard_dir = os.path.join(data_dir, "groups")
+    os.makedirs(shard_dir, exist_ok=True)
+    per_group = max(1, users // groups)
+    members = {}
+    purchases = {}
+    for g in range(groups):
+        group_id = str(100000 + g)
+        uids = [str(10_000_000 + g * per_group + i) for i in range(per_group)]
+        records = {}
+        for index, uid in enumerate(uids):
+            records[uid] = {
+                "coins": float(rng.randint(0, 6000)),
+                "bank": float(rng.randint(0, 2000)),
+                "contractors": [],
+                "contracted_by": None,
+                "last_sign": "2000-01-01T00:00:00",
+                "consecutive": rng.randint(0, 30),
+            }
+            # 约十分之一的用户受雇于前一个用户
+            if index and index % 10 == 1:
+                owner = uids[index - 1]
+                records[uid]["contracted_by"] = owner
+                records[owner]["contractors"].append(uid)
+                purchases[uid] = rng.randint(0, 3)
+        with open(os.path.join(shard_dir, f"{group_id}.json"), "w") as f:
+            json.dump(records, f)
+        members[group_id] = uids
+    with open(os.path.join(shard_dir, "_purchase_counts.json"), "w") as f:
+        json.dump(purchases, f)
+    with open(os.path.join(shard_dir, ".migrated"), "w") as f:
+        f.write("1")
+    return members
+
+
+# ---------------------------------------------------------------------------
+# 负载
+# ---------------------------------------------------------------------------
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.replies = {}
+
+    async def run(self, name: str, agen):
+        started = time.perf_counter()
+        kind = "none"
+        async for result in agen:
+            kind = result[0]
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        key = f"{name}:{kind}"
+        self.replies[key] = self.replies.get(key, 0) + 1
+
+
+def scenario_commands(scenario: str, plugin, event_cls, members: dict, args, rng):
+    group_ids = list(members)[: args.active_groups]
+
+    def sign_in(gid, uid):
+        return "sign_in", plugin.sign_in(event_cls(gid, uid))
+
+    def leaderboard(gid, uid):
+        return "leaderboard", plugin.leaderboard(event_cls(gid, uid))
+
+    def query(gid, uid):
+        return "sign_query", plugin.sign_query(event_cls(gid, uid))
+
+    def trade(gid, uid):
+        target = rng.choice(members[gid])
+        action = rng.random()
+        if action < 0.6:
+            return "purchase", plugin.purchase(event_cls(gid, uid, target))
+        if action < 0.9:
+            return "sell", plugin.sell(event_cls(gid, uid, target))
+        return "terminate_contract", plugin.terminate_contract(event_cls(gid, uid))
+
+    if scenario == "midnight":
+        for gid in group_ids:
+            for uid in members[gid]:
+                yield sign_in(gid, uid)
+        return
+
+    factories = {
+        "leaderboard": ((leaderboard, 0.7), (query, 0.3)),
+        "trading": ((trade, 1.0),),
+        "mixed": ((sign_in, 0.3), (trade, 0.4), (leaderboard, 0.15), (query, 0.15)),
+    }[scenario]
+    choices = [factory for factory, _ in factories]
+    weights = [weight for _, weight in factories]
+    for _ in range(args.commands):
+        gid = rng.choice(group_ids)
+        uid = rng.choice(members[gid])
+        yield rng.choices(choices, weights)[0](gid, uid)
+
+
+async def run_scenario(scenario: str, plugin, event_cls, members, args) -> dict:
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def guarded(name, agen):
+        async with slots:
+            await recorder.run(name, agen)
+
+    written_before = bytes_written()
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            guarded(name, agen)
+            for name, agen in scenario_commands(
+                scenario, plugin, event_cls, members, args, rng
+            )
+        )
+    )
+    await plugin._writer.flush()
+    elapsed = time.perf_counter() - started
+    written = bytes_written() - written_before
+
+    total = sum(len(values) for values in recorder.latencies.values())
+    return {
+        "scenario": scenario,
+        "commands": total,
+        "seconds": round(elapsed, 3),
+        "throughput": round(total / elapsed, 1) if elapsed else None,
+        "bytes_written_per_command": round(written / total, 1) if total else None,
+        "latency_ms": {
+            name: percentiles(values) for name, values in recorder.latencies.items()
+        },
+        "replies": recorder.replies,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def percentiles(values: list) -> dict:
+    ordered = sorted(values)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50": pick(0.5), "p99": pick(0.99)}
+
+
+def bytes_written() -> int:
+    # Linux 下读取进程的累计写入字节数，其他平台返回 0
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KB 为单位
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="qsign-bench-")
+    os.chdir(workdir)
+    try:
+        try:
+            import astrbot.api  # noqa: F401
+        except ImportError:
+            install_astrbot_stubs(args.render_delay)
+        plugin_main = load_plugin_module()
+
+        started = time.perf_counter()
+        members = generate_dataset(
+            plugin_main.DATA_DIR, args.users, args.groups, args.seed
+        )
+        GROUP_MEMBERS.update(members)
+        dataset_seconds = time.perf_counter() - started
+
+        runner, base_url = await start_image_server(args.http_latency)
+        plugin_main.AVATAR_API = base_url + "/avatar?uin={}"
+        config = {
+            "storage_backend": args.backend,
+            "bg_api_url": base_url + "/bg",
+            "leaderboard_image_mode": args.leaderboard_image,
+            **json.loads(args.config),
+        }
+        plugin = plugin_main.ContractSystem(object(), config)
+        await plugin._data_ready.wait()
+
+        from astrbot.api.message_components import At
+        from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
+            AiocqhttpMessageEvent,
+        )
+
+        event_cls = make_event_class(
+            AiocqhttpMessageEvent, At, FakeClient(args.api_latency)
+        )
+
+        results = []
+        for scenario in args.scenario.split(","):
+            results.append(
+                await run_scenario(scenario.strip(), plugin, event_cls, members, args)
+            )
+        await plugin.terminate()
+        await runner.cleanup()
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "users": args.users,
+        "groups": args.groups,
+        "backend": args.backend,
+        "dataset_seconds": round(dataset_seconds, 2),
+        "scenarios": results,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(
+        f"{args.users} 用户 / {args.groups} 个群，后端 {args.backend}，"
+        f"数据集生成 {dataset_seconds:.2f}s"
+    )
+    for result in results:
+        print(
+            f"\n[{result['scenario']}] {result['commands']} 条指令 "
+            f"{result['seconds']}s，吞吐 {result['throughput']}/s，"
+            f"每条写入 {result['bytes_written_per_command']} 字节，"
+            f"峰值 RSS {result['peak_rss_mb']} MB"
+        )
+        for name, stats in sorted(result["latency_ms"].items()):
+            print(
+                f"  {name:<20} n={stats['count']:<7} "
+                f"p50={stats['p50']:>8}ms p99={stats['p99']:>8}ms"
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--active-groups", type=int, default=5, help="参与负载的群数量")
+    parser.add_argument(
+        "--scenario", default=",".join(SCENARIOS), help="逗号分隔的场景列表"
+    )
+    parser.add_argument(
+        "--commands", type=int, default=5000, help="非签到场景的指令条数"
+    )
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--backend", choices=("yaml", "sqlite"), default="yaml")
+    parser.add_argument("--render-delay", type=float, default=0.05)
+    parser.add_argument("--http-latency", type=float, default=0.01)
+    parser.add_argument("--api-latency", type=float, default=0.01)
+    parser.add_argument("--leaderboard-image", action="store_true")
+    parser.add_argument("--config", default="{}", help="额外的插件配置（JSON）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,73 @@
+"""对比旧的 dict 用户数据与 UserRecord 的内存占用。
+
+用法: python benchmarks/bench_memory.py [用户数 ...]
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import UserRecord  # noqa: E402
+
+USERS_PER_GROUP = 500
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+
+def build_dict_model(total_users: int) -> dict:
+    data = {}
+    for i in range(total_users):
+        group = data.setdefault(str(100000 + i // USERS_PER_GROUP), {})
+        group[str(10000000 + i)] = {
+            "coins": float(i % 5000),
+            "bank": float(i % 700),
+            "contractors": [str(10000000 + i + 1)] if i % 3 == 0 else [],
+            "contracted_by": str(10000000 + i - 1) if i % 3 == 1 else None,
+            "last_sign": "2025-01-01T00:00:00",
+            "consecutive": i % 30,
+        }
+    return data
+
+
+def build_record_model(total_users: int) -> dict:
+    data = {}
+    for i in range(total_users):
+        group = data.setdefault(sys.intern(str(100000 + i // USERS_PER_GROUP)), {})
+        group[sys.intern(str(10000000 + i))] = UserRecord(
+            float(i % 5000),
+            float(i % 700),
+            (sys.intern(str(10000000 + i + 1)),) if i % 3 == 0 else (),
+            sys.intern(str(10000000 + i - 1)) if i % 3 == 1 else None,
+            "2025-01-01T00:00:00",
+            i % 30,
+        )
+    return data
+
+
+def measure(builder, total_users: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    data = builder(total_users)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    gc.collect()
+    return current
+
+
+def main(sizes):
+    print(f"{'用户数':>10} {'dict (MB)':>12} {'UserRecord (MB)':>16} {'节省':>8}")
+    for total_users in sizes:
+        dict_bytes = measure(build_dict_model, total_users)
+        record_bytes = measure(build_record_model, total_users)
+        saved = 1 - record_bytes / dict_bytes
+        print(
+            f"{total_users:>10} {dict_bytes / 1048576:>12.1f}"
+            f" {record_bytes / 1048576:>16.1f} {saved:>8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,148 @@
+"""按群分片存储的崩溃恢复检查。
+
+子进程不断写入并定期合并日志，父进程在随机时刻用 SIGKILL 杀掉它，
+然后重新加载，确认每条已确认的写入都还在；每隔几轮再随机损坏最新快照，
+确认加载时回退到上一代、重放日志后数据不变，且损坏的文件被隔离。
+
+用法:
+    python benchmarks/check_crash_recovery.py
+    python benchmarks/check_crash_recovery.py --runs 100 --seed 7
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_load import install_astrbot_stubs, load_plugin_module
+
+GROUP_ID = "g"
+# 子进程轮流覆盖的用户数，校验最近这么多条已确认写入
+USERS = 50
+# 子进程每写这么多条合并一次日志
+COMPACT_EVERY = 7
+FORMATS = ("yaml", "json")
+CORRUPTIONS = ("truncate", "flip", "empty")
+
+
+def load_storage():
+    try:
+        import astrbot.api  # noqa: F401
+    except ImportError:
+        install_astrbot_stubs(0)
+    return load_plugin_module("storage"), load_plugin_module("models")
+
+
+async def run_writer(shard_dir: str, fmt: str):
+    storage, models = load_storage()
+    store = storage.ShardedStore(
+        shard_dir, compact_interval=3600, snapshot_format=fmt, keep_generations=3
+    )
+    await store.load()
+    data = await store.load_group(GROUP_ID)
+    i = max((int(record.coins) for record in data.values()), default=0)
+    while True:
+        i += 1
+        record = models.UserRecord(float(i), float(i))
+        await store.save_batch({GROUP_ID: {f"u{i % USERS}": record}}, {})
+        # 写入返回后才确认，父进程只校验打印过的序号
+        print(i, flush=True)
+        if i % COMPACT_EVERY == 0:
+            await store._shards[GROUP_ID].compact()
+
+
+async def verify(shard_dir: str, fmt: str, acked: int) -> dict:
+    storage, _ = load_storage()
+    store = storage.ShardedStore(shard_dir, snapshot_format=fmt, keep_generations=3)
+    await store.load()
+    data = await store.load_group(GROUP_ID)
+    for i in range(max(1, acked - USERS + 1), acked + 1):
+        record = data.get(f"u{i % USERS}")
+        if record is None or record.coins < i:
+            raise AssertionError(f"第 {i} 条已确认的写入丢失: {record}")
+    await store.close()
+    return store.stats
+
+
+def corrupt_current(storage, shard_dir: str, fmt: str, rng):
+    target = storage.snapshot_path_for(os.path.join(shard_dir, f"{GROUP_ID}.yml"), fmt)
+    try:
+        with open(target, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        # 子进程恰好死在快照轮换途中，这一轮没有可损坏的当前快照
+        return None
+    mode = rng.choice(CORRUPTIONS)
+    if mode == "truncate":
+        raw = raw[: rng.randrange(len(raw))]
+    elif mode == "flip":
+        k = rng.randrange(len(raw))
+        raw = raw[:k] + bytes([raw[k] ^ 0xFF]) + raw[k + 1 :]
+    else:
+        raw = b""
+    with open(target, "wb") as f:
+        f.write(raw)
+    return mode
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    shard_dir = tempfile.mkdtemp(prefix="qsign-crash-")
+    corrupted = 0
+    try:
+        for run in range(args.runs):
+            fmt = rng.choice(FORMATS)
+            writer = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--writer", shard_dir, fmt],
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            time.sleep(rng.uniform(args.min_delay, args.max_delay))
+            os.kill(writer.pid, signal.SIGKILL)
+            writer.wait()
+            acked = writer.stdout.read().split()
+            acked = int(acked[-1]) if acked else 0
+            asyncio.run(verify(shard_dir, fmt, acked))
+            if run % args.corrupt_every != args.corrupt_every - 1:
+                continue
+            mode = corrupt_current(load_storage()[0], shard_dir, fmt, rng)
+            if mode is None:
+                continue
+            stats = asyncio.run(verify(shard_dir, fmt, acked))
+            if stats["fallback_recoveries"] != 1:
+                raise AssertionError(f"损坏方式 {mode} 未触发回退: {stats}")
+            if not any(name.endswith(".corrupt") for name in os.listdir(shard_dir)):
+                raise AssertionError("损坏的快照没有被隔离")
+            corrupted += 1
+            print(f"第 {run} 轮 {fmt}: 已确认 {acked} 条，{mode} 损坏后回退成功")
+        print(
+            f"{args.runs} 轮全部恢复，其中 {corrupted} 轮损坏快照；"
+            f"剩余文件: {sorted(os.listdir(shard_dir))}"
+        )
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-delay", type=float, default=0.3)
+    parser.add_argument("--max-delay", type=float, default=1.2)
+    parser.add_argument(
+        "--corrupt-every", type=int, default=3, help="每隔几轮损坏一次快照"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--writer"]:
+        asyncio.run(run_writer(sys.argv[2], sys.argv[3]))
+    else:
+        main(parse_args())
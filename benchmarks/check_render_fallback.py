@@ -0,0 +1,255 @@
+"""渲染端点熔断与对冲检查。
+
+启动两个本地的模拟 t2i 服务，框架渲染接到主服务，render_endpoints 指向备用服务，
+然后分阶段切换主服务的行为，用签到查询驱动 RenderDispatcher：
+
+    healthy   主服务正常，积累延迟样本
+    failing   主服务返回 500，应在连续失败后熔断，请求转到备用服务
+    recovery  冷却结束后主服务恢复，探测成功后重新闭合
+    stalling  主服务卡住，超过历史延迟分位数后应向备用服务发出对冲请求
+
+每个阶段都要求全部回复是图片，并报告各端点的调用次数与状态。
+
+用法:
+    python benchmarks/check_render_fallback.py
+    python benchmarks/check_render_fallback.py --requests 100 --stall 5
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+from bench_load import (
+    GROUP_MEMBERS,
+    REPO_DIR,
+    FakeClient,
+    install_astrbot_stubs,
+    load_plugin_module,
+    make_event_class,
+    percentiles,
+    start_image_server,
+)
+
+GROUP_ID = "100000"
+FAILURE_THRESHOLD = 3
+
+
+class MockT2I:
+    """模拟 t2i 服务，mode 可在运行中切换为 ok、fail 或 stall。"""
+
+    def __init__(self, name: str, latency: float, stall: float):
+        self.name = name
+        self.latency = latency
+        self.stall = stall
+        self.mode = "ok"
+        self.requests = {}
+        self._ids = itertools.count()
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        from aiohttp import web
+
+        async def generate(request):
+            await request.read()
+            self.requests[self.mode] = self.requests.get(self.mode, 0) + 1
+            if self.mode == "fail":
+                return web.Response(status=500, text="mock failure")
+            await asyncio.sleep(self.stall if self.mode == "stall" else self.latency)
+            return web.json_response({"data": {"id": f"{self.name}-{next(self._ids)}"}})
+
+        app = web.Application()
+        app.router.add_post("/text2img/generate", generate)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def close(self):
+        await self._runner.cleanup()
+
+
+async def post_template(session, base_url: str, tmpl: str, data: dict) -> str:
+    # 与 AstrBot 的网络渲染接口相同的请求形式，返回图片地址
+    async with session.post(
+        f"{base_url}/text2img/generate",
+        json={"tmpl": tmpl, "tmpldata": data, "json": True},
+    ) as resp:
+        resp.raise_for_status()
+        result = await resp.json()
+    return f"{base_url}/text2img/data/{result['data']['id']}"
+
+
+def install_network_strategy_stub(session):
+    class NetworkRenderStrategy:
+        def __init__(self, base_url: str):
+            self.base_url = base_url
+
+        async def render_custom_template(self, tmpl, data, return_url=True):
+            return await post_template(session, self.base_url, tmpl, data)
+
+    for name in ("astrbot.core.utils", "astrbot.core.utils.t2i"):
+        sys.modules.setdefault(name, types.ModuleType(name))
+    module = types.ModuleType("astrbot.core.utils.t2i.network_strategy")
+    module.NetworkRenderStrategy = NetworkRenderStrategy
+    sys.modules[module.__name__] = module
+
+
+async def run_phase(name: str, plugin, event_cls, users: list, concurrency: int):
+    dispatcher = plugin._renderer
+    before = {ep.name: ep.calls for ep in dispatcher.endpoints}
+    hedged = dispatcher.hedged
+    latencies = []
+    replies = {}
+    slots = asyncio.Semaphore(concurrency)
+
+    async def query(uid):
+        async with slots:
+            started = time.perf_counter()
+            async for result in plugin.sign_query(event_cls(GROUP_ID, uid)):
+                replies[result[0]] = replies.get(result[0], 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(query(uid) for uid in users))
+    return {
+        "phase": name,
+        "replies": replies,
+        "latency_ms": percentiles(latencies),
+        "hedged": dispatcher.hedged - hedged,
+        "calls": {ep.name: ep.calls - before[ep.name] for ep in dispatcher.endpoints},
+        "states": {ep.name: ep.state for ep in dispatcher.endpoints},
+    }
+
+
+def check(result: dict, primary: str, secondary: str, args) -> list:
+    problems = []
+    phase = result["phase"]
+    if result["replies"].get("image", 0) != args.requests:
+        problems.append(f"{phase}: 不是全部回复图片 {result['replies']}")
+    if phase == "failing":
+        if result["states"][primary] == "closed":
+            problems.append(f"{phase}: 主服务连续失败后没有熔断")
+        if result["calls"][primary] > FAILURE_THRESHOLD + args.concurrency:
+            problems.append(f"{phase}: 熔断后仍有大量请求发往主服务 {result['calls']}")
+        if result["calls"][secondary] < args.requests:
+            problems.append(f"{phase}: 备用服务没有接手 {result['calls']}")
+    elif phase == "recovery":
+        if result["states"][primary] != "closed":
+            problems.append(f"{phase}: 冷却结束后主服务没有恢复")
+    elif phase == "stalling":
+        if not result["hedged"]:
+            problems.append(f"{phase}: 主服务卡住时没有发出对冲请求")
+        if result["latency_ms"]["p99"] >= args.stall * 1000:
+            problems.append(f"{phase}: 对冲没有缩短延迟 {result['latency_ms']}")
+    return problems
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="qsign-render-")
+    os.chdir(workdir)
+    try:
+        try:
+            import astrbot.api  # noqa: F401
+        except ImportError:
+            install_astrbot_stubs(0)
+        import aiohttp
+
+        session = aiohttp.ClientSession()
+        install_network_strategy_stub(session)
+        plugin_main = load_plugin_module()
+        from astrbot.api.message_components import At
+        from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
+            AiocqhttpMessageEvent,
+        )
+
+        primary = MockT2I("primary", args.latency, args.stall)
+        secondary = MockT2I("secondary", args.latency, args.stall)
+        await primary.start()
+        await secondary.start()
+        runner, base_url = await start_image_server(0)
+        plugin_main.AVATAR_API = base_url + "/avatar?uin={}"
+        config = {
+            "bg_api_url": base_url + "/bg",
+            "render_endpoints": [secondary.url],
+            "render_failure_threshold": FAILURE_THRESHOLD,
+            "render_cooldown": args.cooldown,
+            "render_timeout": args.stall * 2,
+            "render_concurrency": args.concurrency,
+            "render_queue_limit": args.requests,
+            "render_queue_timeout": args.stall * 4,
+        }
+        plugin = plugin_main.ContractSystem(object(), config)
+
+        async def html_render(tmpl, data, return_url=True, options=None):
+            return await post_template(session, primary.url, tmpl, data)
+
+        plugin.html_render = html_render
+        await plugin._data_ready.wait()
+
+        # 每次查询用不同的用户，避免命中卡片缓存而跳过渲染
+        users = (str(10_000_000 + i) for i in itertools.count())
+        GROUP_MEMBERS[GROUP_ID] = []
+        event_cls = make_event_class(AiocqhttpMessageEvent, At, FakeClient(0))
+
+        results = []
+        problems = []
+        names = {"primary": "html_render", "secondary": secondary.url}
+        for phase, mode in (
+            ("healthy", "ok"),
+            ("failing", "fail"),
+            ("recovery", "ok"),
+            ("stalling", "stall"),
+        ):
+            if phase == "recovery":
+                await asyncio.sleep(args.cooldown)
+            primary.mode = mode
+            batch = list(itertools.islice(users, args.requests))
+            result = await run_phase(phase, plugin, event_cls, batch, args.concurrency)
+            results.append(result)
+            problems.extend(check(result, names["primary"], names["secondary"], args))
+
+        await plugin.terminate()
+        await primary.close()
+        await secondary.close()
+        await runner.cleanup()
+        await session.close()
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    short = {names["primary"]: "主", names["secondary"]: "备", "local": "本地"}
+    for result in results:
+        calls = ", ".join(f"{short[k]}={v}" for k, v in result["calls"].items())
+        states = ", ".join(f"{short[k]}={v}" for k, v in result["states"].items())
+        print(
+            f"[{result['phase']}] 回复 {result['replies']}，"
+            f"p50={result['latency_ms']['p50']}ms p99={result['latency_ms']['p99']}ms，"
+            f"对冲 {result['hedged']} 次；调用 {calls}；状态 {states}"
+        )
+    print(f"主服务收到的请求: {primary.requests}，备用服务: {secondary.requests}")
+    if problems:
+        for problem in problems:
+            print("  " + problem)
+        raise SystemExit(f"发现 {len(problems)} 处问题")
+    print("熔断、恢复和对冲均符合预期。")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=60, help="每个阶段的查询次数")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02, help="正常时的渲染耗时")
+    parser.add_argument("--stall", type=float, default=3.0, help="卡住时的渲染耗时")
+    parser.add_argument("--cooldown", type=float, default=2.0, help="熔断冷却时间")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,189 @@
+"""并发交易一致性检查。
+
+在同一个群里让少量用户并发地互相购买、出售、赎身，指令之间随机插入让出点，
+结束后检查雇佣关系双向一致、雇员数不超上限、金币不为负，
+以及金币总量守恒：交易不是零和的，最终的现金加存款总额应等于初始总额
+加上每笔成功交易自己报告的金额变化，重复扣款或漏记都会让两者对不上；
+再在不正常关闭的情况下从磁盘重新加载，确认落盘的数据与内存中的一致。
+
+用法:
+    python benchmarks/check_trade_consistency.py
+    python benchmarks/check_trade_consistency.py --trades 20000 --users 50 --seed 3
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import shutil
+import tempfile
+
+from bench_load import (
+    GROUP_MEMBERS,
+    REPO_DIR,
+    FakeClient,
+    install_astrbot_stubs,
+    load_plugin_module,
+    make_event_class,
+    start_image_server,
+)
+
+GROUP_ID = "100000"
+TRADES = ("purchase", "sell", "terminate_contract")
+MAX_CONTRACTORS = 3
+# 每笔成功交易对全群金币总额的影响，由各交易返回的金额计算
+TRADE_DELTAS = {
+    "_purchase_locked": lambda result: result[1] - result[0],
+    "_sell_locked": lambda sell_price: sell_price,
+    "_terminate_locked": lambda result: result[1] - result[0],
+}
+
+
+def check_invariants(group_data: dict) -> list:
+    problems = []
+    for uid, record in group_data.items():
+        if record.coins < 0 or record.bank < 0:
+            problems.append(f"{uid} 余额为负: {record}")
+        if len(record.contractors) > MAX_CONTRACTORS:
+            problems.append(f"{uid} 雇员超过上限: {record.contractors}")
+        if len(set(record.contractors)) != len(record.contractors):
+            problems.append(f"{uid} 雇员重复: {record.contractors}")
+        for cid in record.contractors:
+            contractor = group_data.get(cid)
+            if contractor is None or contractor.contracted_by != uid:
+                problems.append(f"{uid} 的雇员 {cid} 不认这个雇主")
+        owner = record.contracted_by
+        if owner and uid not in group_data[owner].contractors:
+            problems.append(f"{uid} 的雇主 {owner} 的雇员列表中缺少该用户")
+    return problems
+
+
+def total_coins(group_data: dict) -> float:
+    return math.fsum(record.coins + record.bank for record in group_data.values())
+
+
+def track_deltas(plugin, deltas: list):
+    # 包装加锁后的交易函数，记录每笔成功交易报告的花费与补偿
+    for name, delta in TRADE_DELTAS.items():
+        locked = getattr(plugin, name)
+
+        def tracked(*args, locked=locked, delta=delta):
+            result = locked(*args)
+            deltas.append(delta(result))
+            return result
+
+        setattr(plugin, name, tracked)
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="qsign-trades-")
+    os.chdir(workdir)
+    rng = random.Random(args.seed)
+    try:
+        try:
+            import astrbot.api  # noqa: F401
+        except ImportError:
+            install_astrbot_stubs(0)
+        plugin_main = load_plugin_module()
+        from astrbot.api.message_components import At
+        from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
+            AiocqhttpMessageEvent,
+        )
+
+        users = [str(10_000_000 + i) for i in range(args.users)]
+        GROUP_MEMBERS[GROUP_ID] = users
+        runner, base_url = await start_image_server(0)
+        plugin_main.AVATAR_API = base_url + "/avatar?uin={}"
+        config = {"storage_backend": args.backend, "bg_api_url": base_url + "/bg"}
+        event_cls = make_event_class(AiocqhttpMessageEvent, At, FakeClient(0))
+
+        plugin = plugin_main.ContractSystem(object(), config)
+        await plugin._ensure_group(GROUP_ID)
+        for uid in users:
+            plugin._get_user_data(plugin.sign_data, GROUP_ID, uid).coins = args.coins
+        plugin._persist_users(GROUP_ID, *users)
+
+        # 在加载群数据时随机让出，让各条指令在加锁前后充分交错
+        ensure_group = plugin._ensure_group
+
+        async def jittered_ensure(group_id):
+            await asyncio.sleep(rng.random() * 0.001)
+            await ensure_group(group_id)
+
+        plugin._ensure_group = jittered_ensure
+
+        group_data = plugin.sign_data[GROUP_ID]
+        initial_total = total_coins(group_data)
+        deltas = []
+        track_deltas(plugin, deltas)
+        replies = {}
+
+        async def trade():
+            # 先错开开始时间，出售的目标按当时的雇佣关系选取
+            await asyncio.sleep(rng.random() * args.spread)
+            user_id, target_id = rng.sample(users, 2)
+            kind = rng.choice(TRADES)
+            owners = [uid for uid in users if group_data[uid].contractors]
+            if kind == "sell" and owners:
+                # 出售由有雇员的用户发起，否则几乎都会因不是雇主而被拒绝
+                user_id = rng.choice(owners)
+                target_id = rng.choice(group_data[user_id].contractors)
+            handler = getattr(plugin, kind)
+            async for result in handler(event_cls(GROUP_ID, user_id, target_id)):
+                replies[kind] = replies.get(kind, 0) + 1
+
+        await asyncio.gather(*(trade() for _ in range(args.trades)))
+        await plugin._writer.flush()
+        problems = check_invariants(group_data)
+        expected_total = initial_total + math.fsum(deltas)
+        final_total = total_coins(group_data)
+        if not math.isclose(final_total, expected_total, rel_tol=1e-9):
+            problems.append(
+                f"金币总额不守恒: 初始 {initial_total:.2f}，交易净变化 "
+                f"{math.fsum(deltas):.2f}，实际 {final_total:.2f}"
+            )
+        expected = {uid: record.to_dict() for uid, record in group_data.items()}
+
+        # 不关闭第一个实例就重新加载，相当于刷新后进程立即崩溃：
+        # 正常关闭时的合并会把内存中的记录整体写出，掩盖漏掉的落盘
+        reloaded = plugin_main.ContractSystem(object(), config)
+        await reloaded._ensure_group(GROUP_ID)
+        for uid, record in reloaded.sign_data[GROUP_ID].items():
+            if uid in expected and record.to_dict() != expected[uid]:
+                problems.append(f"{uid} 重新加载后不一致: {record} != {expected[uid]}")
+        missing = set(expected) - set(reloaded.sign_data[GROUP_ID])
+        problems.extend(f"{uid} 重新加载后丢失" for uid in sorted(missing))
+        await reloaded.terminate()
+        await plugin.terminate()
+        await runner.cleanup()
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"{args.trades} 笔交易（成功 {len(deltas)} 笔），{args.users} 名用户，"
+        f"后端 {args.backend}: {replies}"
+    )
+    if problems:
+        for problem in problems[:20]:
+            print("  " + problem)
+        raise SystemExit(f"发现 {len(problems)} 处不一致")
+    print("雇佣关系、余额、金币总额和落盘数据全部一致。")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--trades", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--coins", type=float, default=50000.0, help="每人的初始金币")
+    parser.add_argument(
+        "--spread", type=float, default=2.0, help="各笔交易开始时间的分散范围（秒）"
+    )
+    parser.add_argument("--backend", choices=("yaml", "sqlite"), default="yaml")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
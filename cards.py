@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict
+
+
+class CardCache:
+    """缓存已渲染的查询卡片。
+
+    每个 (群号, 用户) 只保留最近一张卡片及其渲染输入的指纹，
+    指纹一致且未过期时直接复用图片；总条目数按 LRU 限制。
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+        }
+
+    def get(self, group_id: str, user_id: str, fingerprint: tuple):
+        key = (str(group_id), str(user_id))
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != fingerprint or entry[2] <= time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, group_id: str, user_id: str, fingerprint: tuple, image_url: str):
+        if self.max_entries <= 0:
+            return
+        key = (str(group_id), str(user_id))
+        self._entries[key] = (fingerprint, image_url, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, group_id: str, user_id: str):
+        if self._entries.pop((str(group_id), str(user_id)), None) is not None:
+            self.invalidations += 1
+
+    def invalidate_group(self, group_id: str):
+        group_id = str(group_id)
+        for key in [key for key in self._entries if key[0] == group_id]:
+            del self._entries[key]
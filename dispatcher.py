@@ -0,0 +1,258 @@
+import asyncio
+import time
+from collections import deque
+
+from astrbot.api import logger
+
+from .images import data_uri
+
+
+class RenderJob:
+    """一次渲染请求。背景和头像保存为原始字节，HTML 端点需要时才编码。"""
+
+    __slots__ = (
+        "template",
+        "render_data",
+        "card_name",
+        "background",
+        "avatar",
+        "_html",
+    )
+
+    def __init__(
+        self,
+        template: str,
+        render_data: dict,
+        card_name: str = None,
+        background=None,
+        avatar=None,
+    ):
+        self.template = template
+        self.render_data = render_data
+        self.card_name = card_name
+        self.background = background
+        self.avatar = avatar
+        self._html = None
+
+    def html_data(self) -> dict:
+        # 对冲请求会复用同一份编码结果
+        if self._html is None:
+            self._html = dict(self.render_data)
+            if self.card_name is not None:
+                self._html["bg_image_data"] = (
+                    data_uri(*self.background) if self.background else ""
+                )
+                self._html["avatar_data"] = (
+                    data_uri(*self.avatar) if self.avatar else ""
+                )
+        return self._html
+
+
+class RenderEndpoint:
+    """单个渲染端点及其熔断状态。
+
+    连续失败达到阈值后熔断，冷却期内直接跳过；冷却结束后放行一次探测请求，
+    成功则恢复，失败则重新进入冷却。探测名额在 available() 选中端点时就被占用，
+    由调用方在探测请求结束或决定不再发出时调用 release_probe() 归还。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        render,
+        supports=None,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        window: int = 100,
+    ):
+        self.name = name
+        self._render = render
+        self._supports = supports
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._probing = False
+
+        self.calls = 0
+        self.failures = 0
+        self.skipped = 0
+
+    @property
+    def state(self) -> str:
+        if self._consecutive_failures < self.failure_threshold:
+            return "closed"
+        if time.monotonic() < self._open_until:
+            return "open"
+        return "half_open"
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "error_rate": round(self.error_rate(), 3),
+            "p50_ms": _ms(self.latency_percentile(0.5)),
+            "p95_ms": _ms(self.latency_percentile(0.95)),
+        }
+
+    @property
+    def samples(self) -> int:
+        return len(self._latencies)
+
+    def supports(self, job: RenderJob) -> bool:
+        return self._supports is None or self._supports(job)
+
+    def available(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            # 调用要等到对冲或前一个端点失败后才发出，必须在选中时就占住名额
+            self._probing = True
+            return True
+        self.skipped += 1
+        return False
+
+    def release_probe(self):
+        self._probing = False
+
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def latency_percentile(self, percentile: float):
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(percentile * len(ordered)))
+        return ordered[index]
+
+    async def call(self, job: RenderJob, timeout: float) -> str:
+        self.calls += 1
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self._render(job), timeout=timeout)
+        except asyncio.CancelledError:
+            # 对冲请求中落败的一方被取消，不计入失败
+            raise
+        except Exception as e:
+            logger.warning(f"渲染端点 {self.name} 失败: {e!r}")
+            result = ""
+        if result:
+            self._latencies.append(time.monotonic() - started)
+            self._outcomes.append(True)
+            self._consecutive_failures = 0
+        else:
+            self._record_failure()
+        return result
+
+    def _record_failure(self):
+        self.failures += 1
+        self._outcomes.append(False)
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.failure_threshold:
+            self._open_until = time.monotonic() + self.cooldown
+            if self._consecutive_failures == self.failure_threshold:
+                logger.warning(f"渲染端点 {self.name} 已熔断 {self.cooldown:.0f} 秒。")
+
+
+class RenderDispatcher:
+    """按顺序尝试多个渲染端点。
+
+    熔断中的端点直接跳过；当前请求耗时超过该端点历史延迟的指定分位数时，
+    向下一个端点发出对冲请求，取先成功的结果。
+    """
+
+    def __init__(
+        self,
+        endpoints: list,
+        timeout: float = 15.0,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+    ):
+        self.endpoints = endpoints
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+        self.hedged = 0
+        self.exhausted = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hedged": self.hedged,
+            "exhausted": self.exhausted,
+            "endpoints": {ep.name: ep.stats for ep in self.endpoints},
+        }
+
+    async def render(self, job: RenderJob) -> str:
+        # 选中半开端点即占用其探测名额，记下哪些候选持有名额，未调用时归还
+        candidates = deque()
+        for endpoint in self.endpoints:
+            if endpoint.supports(job):
+                probe = endpoint.state == "half_open"
+                if endpoint.available():
+                    candidates.append((endpoint, probe))
+        running = {}
+        try:
+            while True:
+                if not running:
+                    if not candidates:
+                        self.exhausted += 1
+                        return ""
+                    self._start(running, candidates.popleft(), job)
+
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=self._hedge_delay(running),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    if candidates:
+                        self.hedged += 1
+                        self._start(running, candidates.popleft(), job)
+                    else:
+                        # 没有可对冲的端点，继续等待已发出的请求
+                        done, _ = await asyncio.wait(
+                            running, return_when=asyncio.FIRST_COMPLETED
+                        )
+                for task in done:
+                    del running[task]
+                    result = task.result()
+                    if result:
+                        return result
+        finally:
+            for task in running:
+                task.cancel()
+            for endpoint, probe in candidates:
+                if probe:
+                    endpoint.release_probe()
+
+    def _start(self, running: dict, candidate: tuple, job: RenderJob):
+        endpoint, probe = candidate
+        task = asyncio.ensure_future(endpoint.call(job, self.timeout))
+        if probe:
+            # 请求结束（包括被取消、甚至还没开始就被取消）后才归还探测名额
+            task.add_done_callback(lambda _: endpoint.release_probe())
+        running[task] = candidate
+
+    def _hedge_delay(self, running: dict):
+        # 只根据最早发出的请求决定何时对冲，且要求有足够的延迟样本
+        if len(running) > 1:
+            return None
+        endpoint, _ = next(iter(running.values()))
+        if endpoint.samples < self.hedge_min_samples:
+            return None
+        return endpoint.latency_percentile(self.hedge_percentile)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
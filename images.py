@@ -0,0 +1,409 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import aiofiles
+from PIL import Image, ImageOps
+
+from astrbot.api import logger
+
+
+def data_uri(data: bytes, mime: str = "image/jpeg") -> str:
+    encoded = base64.b64encode(data).decode("utf-8")
+    return f"data:{mime};base64,{encoded}"
+
+
+def prepare_image(
+    data: bytes, size: tuple, crop: bool, fmt: str = "jpeg", quality: int = 80
+):
+    """缩放并重新编码一张图片，返回 (字节, MIME)，无法解码时返回 None。
+
+    crop 为真时居中裁剪为 size（头像）；否则等比缩小到恰好铺满 size，
+    对应模板中的 background-size: cover，不裁剪也不放大。
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        # JPEG 可在解码时直接按 1/2、1/4、1/8 缩小，省去大部分解码开销
+        side = max(size)
+        image.draft("RGB", (side, side))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P", "PA"):
+            image = image.convert("RGBA")
+            flattened = Image.new("RGB", image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel("A"))
+            image = flattened
+        else:
+            image = image.convert("RGB")
+
+        resized = True
+        if crop:
+            image = ImageOps.fit(image, size, Image.LANCZOS)
+        else:
+            scale = max(size[0] / image.width, size[1] / image.height)
+            if scale < 1:
+                image = image.resize(
+                    (
+                        max(1, round(image.width * scale)),
+                        max(1, round(image.height * scale)),
+                    ),
+                    Image.LANCZOS,
+                )
+            else:
+                resized = False
+
+        output = io.BytesIO()
+        if fmt == "webp":
+            image.save(output, "WEBP", quality=quality, method=4)
+            mime = "image/webp"
+        else:
+            image.save(output, "JPEG", quality=quality)
+            mime = "image/jpeg"
+    except Exception:
+        return None
+    # 原图本来就不大时，重新编码可能反而更大
+    if not resized and output.tell() >= len(data):
+        return None
+    return output.getvalue(), mime
+
+
+class ImagePreprocessor:
+    """在线程池中缩放、重新编码背景和头像，处理结果按内容和目标尺寸缓存。
+
+    Pillow 解码、缩放和编码时会释放 GIL，线程池即可并行处理，
+    也不必把多 MB 的原图复制到其他进程。处理失败时原样返回输入。
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        fmt: str = "jpeg",
+        quality: int = 80,
+        max_bytes: int = 16 * 1024 * 1024,
+    ):
+        self.workers = max(1, workers)
+        self.fmt = fmt
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self._executor = None
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.unchanged = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "unchanged": self.unchanged,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+        }
+
+    async def prepare(self, image, size: tuple, crop: bool = False, cache: bool = True):
+        """image 为 (字节, MIME)，返回处理后的 (字节, MIME)。"""
+        if not image:
+            return image
+        data = image[0]
+        key = (zlib.crc32(data), len(data), size, crop)
+        cached = self._memory.get(key)
+        if cached is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._process(image, size, crop))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        result = await asyncio.shield(task)
+        if cache and key not in self._memory:
+            self._remember(key, result)
+        return result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _process(self, image, size: tuple, crop: bool):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="qsign-image"
+            )
+        loop = asyncio.get_running_loop()
+        processed = await loop.run_in_executor(
+            self._executor,
+            prepare_image,
+            image[0],
+            size,
+            crop,
+            self.fmt,
+            self.quality,
+        )
+        self.bytes_in += len(image[0])
+        if processed is None:
+            self.unchanged += 1
+            processed = image
+        self.bytes_out += len(processed[0])
+        return processed
+
+    def _remember(self, key: tuple, image):
+        self._memory[key] = image
+        self._memory_bytes += len(image[0])
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted[0])
+
+
+class BackgroundPool:
+    """预取背景图的有界池。
+
+    后台任务预先下载若干张背景图（原始字节和 MIME 类型），渲染时直接取用，
+    取走后异步补充；池为空时由调用方使用本地备用图。
+    """
+
+    def __init__(self, fetch, size: int = 3, max_failures: int = 3):
+        self._fetch = fetch
+        self.size = max(0, size)
+        self.max_failures = max_failures
+        self._pool = deque()
+        self._refill_task = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._pool)
+
+    def start(self):
+        self._kick()
+
+    def pop(self):
+        if self._pool:
+            self.hits += 1
+            data = self._pool.popleft()
+        else:
+            self.misses += 1
+            data = None
+        self._kick()
+        return data
+
+    async def close(self):
+        if self._refill_task and not self._refill_task.done():
+            self._refill_task.cancel()
+            await asyncio.gather(self._refill_task, return_exceptions=True)
+        self._pool.clear()
+
+    def _kick(self):
+        if len(self._pool) >= self.size:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        failures = 0
+        while len(self._pool) < self.size:
+            data = await self._fetch()
+            if data:
+                failures = 0
+                self._pool.append(data)
+                continue
+            failures += 1
+            if failures >= self.max_failures:
+                # 接口暂时不可用，等下一次取用时再尝试补充
+                logger.warning("背景图预取连续失败，暂停补充。")
+                return
+            await asyncio.sleep(2**failures)
+
+
+class _AvatarEntry:
+    __slots__ = ("data", "mime", "etag", "last_modified", "fetched_at")
+
+    def __init__(self, data, mime, etag=None, last_modified=None, fetched_at=0.0):
+        self.data = data
+        self.mime = mime
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def meta(self) -> dict:
+        return {
+            "mime": self.mime,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "fetched_at": self.fetched_at,
+        }
+
+
+class AvatarCache:
+    """头像缓存：内存 LRU（按总字节数限制）+ 磁盘缓存。
+
+    条目过期后使用 ETag/Last-Modified 做条件请求，服务端返回 304 时只刷新时间戳；
+    同一用户的并发请求共享一次下载。
+    """
+
+    def __init__(
+        self,
+        session,
+        url_template: str,
+        cache_dir: str,
+        ttl: float = 3600.0,
+        max_bytes: int = 32 * 1024 * 1024,
+    ):
+        self.session = session
+        self.url_template = url_template
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.coalesced = 0
+        self.bytes_downloaded = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "coalesced": self.coalesced,
+            "bytes_downloaded": self.bytes_downloaded,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+        }
+
+    async def get_entry(self, user_id: str):
+        user_id = str(user_id)
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._get(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _get(self, user_id: str):
+        entry = self._memory.get(user_id)
+        if entry is not None:
+            self._memory.move_to_end(user_id)
+        else:
+            entry = await self._load_from_disk(user_id)
+            if entry is not None:
+                self._remember(user_id, entry)
+
+        if entry is not None and time.time() - entry.fetched_at < self.ttl:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        fresh = await self._download(user_id, entry)
+        if fresh is None:
+            # 下载失败时宁可使用过期的头像
+            return entry
+        self._remember(user_id, fresh)
+        await self._save_to_disk(user_id, fresh)
+        return fresh
+
+    async def _download(self, user_id: str, stale):
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers["If-None-Match"] = stale.etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+        url = self.url_template.format(user_id)
+        try:
+            async with self.session.get(url, headers=headers) as response:
+                if response.status == 304 and stale is not None:
+                    self.revalidated += 1
+                    return _AvatarEntry(
+                        stale.data,
+                        stale.mime,
+                        stale.etag,
+                        stale.last_modified,
+                        time.time(),
+                    )
+                if response.status != 200:
+                    logger.error(f"下载头像失败 ({url})，状态码: {response.status}")
+                    return None
+                data = await response.read()
+                self.bytes_downloaded += len(data)
+                return _AvatarEntry(
+                    data,
+                    response.headers.get("Content-Type", "image/jpeg"),
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    time.time(),
+                )
+        except Exception as e:
+            logger.error(f"下载头像时发生异常 ({url}): {e}")
+            return None
+
+    def _remember(self, user_id: str, entry):
+        old = self._memory.pop(user_id, None)
+        if old is not None:
+            self._memory_bytes -= len(old.data)
+        self._memory[user_id] = entry
+        self._memory_bytes += len(entry.data)
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.data)
+
+    def _paths(self, user_id: str) -> tuple:
+        base = os.path.join(self.cache_dir, user_id)
+        return f"{base}.img", f"{base}.json"
+
+    async def _load_from_disk(self, user_id: str):
+        image_path, meta_path = self._paths(user_id)
+        try:
+            async with aiofiles.open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.loads(await f.read())
+            async with aiofiles.open(image_path, "rb") as f:
+                data = await f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取头像缓存失败 ({user_id}): {e}")
+            return None
+        return _AvatarEntry(
+            data,
+            meta.get("mime", "image/jpeg"),
+            meta.get("etag"),
+            meta.get("last_modified"),
+            meta.get("fetched_at", 0.0),
+        )
+
+    async def _save_to_disk(self, user_id: str, entry):
+        image_path, meta_path = self._paths(user_id)
+        try:
+            async with aiofiles.open(image_path, "wb") as f:
+                await f.write(entry.data)
+            async with aiofiles.open(meta_path, "w", encoding="utf-8") as f:
+                await f.write(json.dumps(entry.meta()))
+        except Exception as e:
+            logger.warning(f"写入头像缓存失败 ({user_id}): {e}")
@@ -0,0 +1,365 @@
+import asyncio
+import json
+import os
+import re
+import time
+
+from astrbot.api import logger
+
+# 每人在内存索引中保留的最近记录条数
+INDEX_DEPTH = 20
+# 导出时每次读取的字节数
+EXPORT_CHUNK = 64 * 1024
+# 偏移量打包为 段号 << OFFSET_BITS | 段内偏移
+OFFSET_BITS = 40
+# 写盘失败后等待多久再重试（秒）
+RETRY_DELAY = 5.0
+
+ACTION_LABELS = {
+    "sign_in": "签到",
+    "deposit": "存款",
+    "withdraw": "取款",
+    "purchase": "雇佣",
+    "takeover": "雇员被收购",
+    "sell": "解雇",
+    "redeem": "赎身",
+    "redeemed": "雇员赎身",
+}
+
+_SEGMENT_RE = re.compile(r"^ledger\.(\d+)\.log$")
+
+
+class Ledger:
+    """只追加的交易流水，按大小分段轮转。
+
+    每条记录是一行紧凑的 JSON 数组：
+    [时间戳, 群号, 用户ID, 动作, 现金变化, 存款变化, 现金余额, 存款余额, 对方ID]。
+    记录在交易的同步部分写入缓冲并立即分配文件偏移，由后台任务批量落盘；
+    内存中按 (群号, 用户) 保存最近记录的偏移，查询时直接定位而不扫描文件。
+    写盘失败时整批放回待写队列并稍后重试，重试前把分段截回到这批第一条的偏移，
+    已分配的偏移始终有效。封存的分段旁边写一份 .idx 索引，启动时只需扫描当前分段。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 4 * 1024 * 1024, keep: int = 8):
+        self.directory = directory
+        self.max_bytes = max(1024, max_bytes)
+        self.keep = max(1, keep)
+
+        self._index = {}
+        self._pending = []
+        self._seq = 0
+        self._size = 0
+        self._oldest = 0
+        self._file = None
+        self._file_seq = None
+        self._flush_task = None
+        self._retry_at = 0.0
+        self._retry_handle = None
+        self._write_lock = asyncio.Lock()
+
+        self.recorded = 0
+        self.written = 0
+        self.write_failures = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "write_failures": self.write_failures,
+            "pending": len(self._pending),
+            "segments": self._seq - self._oldest + 1,
+            "indexed_users": len(self._index),
+        }
+
+    async def open(self):
+        await asyncio.to_thread(self._open)
+
+    def record(
+        self,
+        group_id: str,
+        user_id: str,
+        action: str,
+        coins: float,
+        bank: float,
+        coins_after: float,
+        bank_after: float,
+        peer: str = None,
+    ):
+        line = (
+            json.dumps(
+                [
+                    int(time.time()),
+                    group_id,
+                    user_id,
+                    action,
+                    round(coins, 2),
+                    round(bank, 2),
+                    round(coins_after, 2),
+                    round(bank_after, 2),
+                    peer,
+                ],
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            + "\n"
+        ).encode("utf-8")
+        if self._size and self._size + len(line) > self.max_bytes:
+            self._seq += 1
+            self._size = 0
+        self._remember(group_id, user_id, self._seq, self._size)
+        self._pending.append((self._seq, self._size, line))
+        self._size += len(line)
+        self.recorded += 1
+        if time.monotonic() >= self._retry_at:
+            self._schedule_flush()
+
+    async def flush(self):
+        async with self._write_lock:
+            # 写盘期间新记录的条目也在这里写完，不会滞留到下一次调用
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await asyncio.to_thread(self._write, batch)
+                except Exception as e:
+                    # 放回队首，保持顺序和已分配的偏移，稍后从这批第一条重写
+                    self._pending[:0] = batch
+                    self.write_failures += 1
+                    await asyncio.to_thread(self._discard_file)
+                    logger.error(
+                        f"交易流水写入失败，{len(self._pending)} 条记录将在 "
+                        f"{RETRY_DELAY:.0f} 秒后重试: {e}"
+                    )
+                    self._retry_at = time.monotonic() + RETRY_DELAY
+                    if self._retry_handle is None:
+                        self._retry_handle = asyncio.get_running_loop().call_later(
+                            RETRY_DELAY, self._retry_flush
+                        )
+                    return
+                self.written += len(batch)
+
+    async def recent(self, group_id: str, user_id: str, limit: int = 10) -> list:
+        """按时间倒序返回某人最近的记录。"""
+        await self.flush()
+        positions = [
+            packed
+            for packed in reversed(self._index.get((group_id, user_id), ()))
+            if packed >> OFFSET_BITS >= self._oldest
+        ][:limit]
+        if not positions:
+            return []
+        return await asyncio.to_thread(self._read_at, positions)
+
+    async def export(self, dest_path: str, group_id: str = None) -> int:
+        """把流水逐块复制到 dest_path，可只保留某个群的记录，返回条数。"""
+        await self.flush()
+        async with self._write_lock:
+            return await asyncio.to_thread(self._export, dest_path, group_id)
+
+    async def close(self):
+        if self._retry_handle is not None:
+            self._retry_handle.cancel()
+            self._retry_handle = None
+        await self.flush()
+        if self._pending:
+            logger.error(f"关闭时仍有 {len(self._pending)} 条交易流水未能写入。")
+        async with self._write_lock:
+            if self._file is not None:
+                await asyncio.to_thread(self._file.close)
+                self._file = None
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    def _retry_flush(self):
+        self._retry_handle = None
+        self._schedule_flush()
+
+    def _remember(self, group_id: str, user_id: str, seq: int, offset: int):
+        key = (group_id, user_id)
+        positions = self._index.get(key)
+        if positions is None:
+            positions = self._index[key] = []
+        positions.append(seq << OFFSET_BITS | offset)
+        # 摊还裁剪，避免每次追加都移动列表
+        if len(positions) > 2 * INDEX_DEPTH:
+            del positions[:-INDEX_DEPTH]
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"ledger.{seq:06d}.log")
+
+    def _segments(self) -> list:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            int(match.group(1)) for match in map(_SEGMENT_RE.match, names) if match
+        )
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        if not segments:
+            return
+        self._oldest = segments[0]
+        self._seq = segments[-1]
+        for seq in segments[:-1]:
+            index = self._load_index(seq)
+            if index is None:
+                index = self._seal(seq)
+            for group_id, users in index.items():
+                for user_id, offsets in users.items():
+                    for offset in offsets:
+                        self._remember(group_id, user_id, seq, offset)
+        for group_id, user_id, offset in self._scan(self._seq):
+            self._remember(group_id, user_id, self._seq, offset)
+        path = self._segment_path(self._seq)
+        self._size = os.path.getsize(path)
+        if self._size:
+            with open(path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # 补齐崩溃时写了一半的行，后续记录从新行开始
+                    f.write(b"\n")
+                    self._size += 1
+
+    def _write(self, batch: list):
+        checked = False
+        for seq, offset, line in batch:
+            if self._file_seq != seq:
+                self._switch_segment(seq)
+                checked = False
+            if not checked:
+                if self._file.tell() != offset:
+                    # 上次写入失败时可能留下半截数据，截回到这条记录的偏移
+                    self._file.truncate(offset)
+                    self._file.seek(offset)
+                checked = True
+            self._file.write(line)
+        self._file.flush()
+
+    def _discard_file(self):
+        # 写失败的句柄不再使用，重试时重新打开并按偏移截断
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+            self._file_seq = None
+
+    def _switch_segment(self, seq: int):
+        if self._file is not None:
+            self._file.close()
+            self._seal(self._file_seq)
+        self._file = open(self._segment_path(seq), "ab")
+        self._file_seq = seq
+        # 超出保留数量的旧分段连同索引一并删除
+        segments = self._segments()
+        for old in segments[: max(0, len(segments) - self.keep)]:
+            for path in (self._segment_path(old), self._index_path(old)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        remaining = self._segments()
+        self._oldest = remaining[0] if remaining else seq
+
+    def _index_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"ledger.{seq:06d}.idx")
+
+    def _seal(self, seq: int) -> dict:
+        index = {}
+        for group_id, user_id, offset in self._scan(seq):
+            offsets = index.setdefault(group_id, {}).setdefault(user_id, [])
+            offsets.append(offset)
+            if len(offsets) > INDEX_DEPTH:
+                del offsets[0]
+        tmp_path = self._index_path(seq) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self._index_path(seq))
+        return index
+
+    def _load_index(self, seq: int):
+        try:
+            with open(self._index_path(seq), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _scan(self, seq: int):
+        offset = 0
+        try:
+            with open(self._segment_path(seq), "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的行
+                        entry = None
+                    if entry:
+                        yield entry[1], entry[2], offset
+                    offset += len(line)
+        except FileNotFoundError:
+            return
+
+    def _read_at(self, positions: list) -> list:
+        entries = []
+        handles = {}
+        try:
+            for packed in positions:
+                seq = packed >> OFFSET_BITS
+                f = handles.get(seq)
+                if f is None:
+                    try:
+                        f = handles[seq] = open(self._segment_path(seq), "rb")
+                    except FileNotFoundError:
+                        continue
+                f.seek(packed & ((1 << OFFSET_BITS) - 1))
+                try:
+                    entries.append(json.loads(f.readline()))
+                except ValueError:
+                    continue
+        finally:
+            for f in handles.values():
+                f.close()
+        return entries
+
+    def _export(self, dest_path: str, group_id: str = None) -> int:
+        count = 0
+        tmp_path = dest_path + ".tmp"
+        with open(tmp_path, "wb") as out:
+            for seq in self._segments():
+                try:
+                    f = open(self._segment_path(seq), "rb")
+                except FileNotFoundError:
+                    continue
+                with f:
+                    remainder = b""
+                    while chunk := f.read(EXPORT_CHUNK):
+                        lines = (remainder + chunk).split(b"\n")
+                        remainder = lines.pop()
+                        count += self._export_lines(out, lines, group_id)
+                    if remainder:
+                        count += self._export_lines(out, [remainder], group_id)
+        os.replace(tmp_path, dest_path)
+        return count
+
+    def _export_lines(self, out, lines: list, group_id: str) -> int:
+        kept = []
+        for line in lines:
+            if not line:
+                continue
+            if group_id is not None:
+                try:
+                    if json.loads(line)[1] != group_id:
+                        continue
+                except ValueError:
+                    continue
+            kept.append(line)
+        if kept:
+            out.write(b"\n".join(kept) + b"\n")
+        return len(kept)
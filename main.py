@@ -1,25 +1,53 @@
 import asyncio
-import base64
+import json
 import os
-from datetime import datetime
+import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from functools import partial, wraps
 
-import aiofiles
 import aiohttp
 import pytz
-import yaml
 
 from astrbot.api import AstrBotConfig, logger
 from astrbot.api.event import AstrMessageEvent, filter
 from astrbot.api.message_components import At
 from astrbot.api.star import Context, Star, register
 
+from .cards import CardCache
+from .dispatcher import RenderDispatcher, RenderEndpoint, RenderJob
+from .images import AvatarCache, BackgroundPool, ImagePreprocessor, data_uri
+from .ledger import ACTION_LABELS, Ledger
+from .metrics import Metrics, directory_sizes, hit_rate, instrumented
+from .models import UserRecord
+from .names import NameResolver
+from .ranking import RankIndex
+from .renderer import AVATAR_SIZE, CARD_SIZE, OUTPUT_GRACE, LocalRenderer
+from .scheduler import RenderOverloaded, RenderScheduler
+from .settlement import settle
+from .transactions import Transaction, TransactionError, UserLocks
+from .valuation import Valuation
+from .storage import CheckpointError, ShardedStore, SqliteStore, WriteBehind
+
 PLUGIN_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join("data", "astrbot_plugin_Qsign")
 DATA_FILE = os.path.join(DATA_DIR, "sign_data.yml")
 PURCHASE_DATA_FILE = os.path.join(DATA_DIR, "purchase_counts.yml")
+AVATAR_CACHE_DIR = os.path.join(DATA_DIR, "avatars")
+CARD_OUTPUT_DIR = os.path.join(DATA_DIR, "cards")
+JOURNAL_FILE = os.path.join(DATA_DIR, "sign_data.journal")
+SQLITE_FILE = os.path.join(DATA_DIR, "sign_data.db")
+SHARD_DIR = os.path.join(DATA_DIR, "groups")
+SETTLEMENT_FILE = os.path.join(DATA_DIR, "settlement.json")
+LEDGER_DIR = os.path.join(DATA_DIR, "ledger")
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
 
 # API配置
 AVATAR_API = "http://q.qlogo.cn/headimg_dl?dst_uin={}&spec=640&img_type=jpg"
+# 与 leaderboard_template.html 中的头像尺寸一致
+LEADERBOARD_AVATAR_SIZE = 56
 
 WEALTH_LEVELS = [
     (0, "平民", 0.25),
@@ -30,6 +58,24 @@ WEALTH_LEVELS = [
 WEALTH_BASE_VALUES = {"平民": 100.0, "小资": 500.0, "富豪": 2000.0, "巨擘": 5000.0}
 BASE_INCOME = 100.0
 SHANGHAI_TZ = pytz.timezone("Asia/Shanghai")
+# 日结时每批写入日志的用户数
+SETTLEMENT_CHUNK = 2000
+DATA_UNAVAILABLE_MESSAGE = "数据损坏，插件暂停服务"
+
+
+def requires_data(handler):
+    """数据加载失败时直接回复提示，不再进入读写数据的指令。"""
+
+    @wraps(handler)
+    async def wrapper(self, event: AstrMessageEvent, *args, **kwargs):
+        await self._data_ready.wait()
+        if self._load_error is not None:
+            yield event.plain_result(DATA_UNAVAILABLE_MESSAGE)
+            return
+        async for result in handler(self, event, *args, **kwargs):
+            yield result
+
+    return wrapper
 
 
 @register(
@@ -45,18 +91,99 @@ class ContractSystem(Star):
         self.config = config
         self.font_path = os.path.join(PLUGIN_DIR, "请以你的名字呼唤我.ttf")
         self.template_path = os.path.join(PLUGIN_DIR, "card_template.html")
+        self.leaderboard_template_path = os.path.join(
+            PLUGIN_DIR, "leaderboard_template.html"
+        )
         self.default_bg_path = os.path.join(PLUGIN_DIR, "default_bg.jpg")
 
+        self._metrics = Metrics()
         timeout = aiohttp.ClientTimeout(total=10)
         self.session = aiohttp.ClientSession(timeout=timeout)
         self._init_env()
-        self.html_template = self._load_template()
+        self.html_template = self._load_template(self.template_path)
+        self.leaderboard_template = self._load_template(self.leaderboard_template_path)
+        self._leaderboard_cards = {}
+        self._card_cache = CardCache(
+            max_entries=self.config.get("card_cache_size", 256),
+            ttl=self.config.get("card_cache_ttl", 60),
+        )
+        self.default_bg = self._read_image_file(self.default_bg_path)
+        self._local_renderer = LocalRenderer(
+            self.font_path,
+            CARD_OUTPUT_DIR,
+            workers=self.config.get("render_workers", 2),
+            keep_seconds=self.config.get("card_cache_ttl", 60) + OUTPUT_GRACE,
+        )
+        self._render_strategies = {}
+        self._renderer = self._create_renderer()
+        self._render_scheduler = RenderScheduler(
+            concurrency=self.config.get("render_concurrency", 4),
+            queue_limit=self.config.get("render_queue_limit", 50),
+            max_wait=self.config.get("render_queue_timeout", 20),
+        )
+        self._images = ImagePreprocessor(
+            workers=self.config.get("image_workers", 2),
+            fmt=self.config.get("image_format", "jpeg"),
+            quality=self.config.get("image_quality", 80),
+        )
+        self._bg_pool = BackgroundPool(
+            self._fetch_background, size=self.config.get("bg_pool_size", 3)
+        )
+        self._bg_pool.start()
+        self._names = NameResolver(
+            self._fetch_member_name,
+            self._fetch_member_names,
+            ttl=self.config.get("name_cache_ttl", 600),
+            max_entries=self.config.get("name_cache_size", 50000),
+        )
+        self._avatar_cache = AvatarCache(
+            self.session,
+            AVATAR_API,
+            AVATAR_CACHE_DIR,
+            ttl=self.config.get("avatar_cache_ttl", 3600),
+            max_bytes=int(self.config.get("avatar_cache_mb", 32) * 1024 * 1024),
+        )
 
+        self._store = self._create_store()
+        self._writer = WriteBehind(
+            self._store,
+            self._lookup_user,
+            self._lookup_purchase,
+            window=self.config.get("flush_window", 1.0),
+            metrics=self._metrics,
+        )
+        self._ledger = Ledger(
+            LEDGER_DIR,
+            max_bytes=int(self.config.get("ledger_max_mb", 4) * 1024 * 1024),
+            keep=self.config.get("ledger_keep_files", 8),
+        )
         self.sign_data = {}
         self.purchase_data = {}
+        self._data_ready = asyncio.Event()
+        self._load_error = None
+        self._group_loads = {}
+        self._group_access = OrderedDict()
+        self._evict_task = None
+        self._wealth_ranks = {}
+        self._value_ranks = {}
+        self._valuation = Valuation(
+            WEALTH_LEVELS,
+            WEALTH_BASE_VALUES,
+            price_bonus=self.config.get("contract_level_price_bonus", 0.15),
+            rate_bonus=self.config.get("contract_level_rate_bonus", 0.075),
+        )
+        self._locks = UserLocks()
+        self._settled_rates = {}
+        self._settling = False
+        self._settlement_task = None
         asyncio.create_task(self._load_all_data_to_cache())
+        self._export_task = None
+        if self.config.get("metrics_export", "off") in ("json", "prometheus"):
+            self._export_task = asyncio.create_task(self._export_metrics_loop())
 
     @filter.regex(r"^购买")
+    @instrumented("purchase")
+    @requires_data
     async def purchase(self, event: AstrMessageEvent):
         target_id = None
         for component in event.message_obj.message:
@@ -70,60 +197,26 @@ class ContractSystem(Star):
 
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
+        await self._ensure_group(group_id)
 
         if user_id == target_id:
             yield event.plain_result("您不能购买自己。")
             return
 
-        employer_data = self._get_user_data(self.sign_data, group_id, user_id)
-        target_data = self._get_user_data(self.sign_data, group_id, target_id)
-
-        if len(employer_data["contractors"]) >= 3:
-            yield event.plain_result("已达到最大雇佣数量（3人）。")
+        try:
+            async with self._lock_trade(
+                group_id, user_id, target_id
+            ) as original_owner_id:
+                total_cost, compensation = self._purchase_locked(
+                    group_id, user_id, target_id, original_owner_id
+                )
+        except TransactionError as e:
+            yield event.plain_result(str(e))
             return
 
-        base_cost = self._calculate_dynamic_wealth_value(
-            target_data, self.purchase_data, target_id
-        )
-        total_cost = base_cost
-        original_owner_id = target_data.get("contracted_by")
-
         if original_owner_id:
-            if original_owner_id == user_id:
-                yield event.plain_result("该用户已经是您的雇员了。")
-                return
-
-            takeover_rate = self.config.get("takeover_fee_rate", 0.1)
-            extra_cost = base_cost * takeover_rate
-            total_cost += extra_cost
-            compensation = total_cost
-
-            if employer_data["coins"] < total_cost:
-                yield event.plain_result(
-                    f"现金不足，恶意收购需要支付 {total_cost:.1f} 金币（含{takeover_rate * 100}%额外费用）。"
-                )
-                return
-
-            original_owner_data = self._get_user_data(
-                self.sign_data, group_id, original_owner_id
-            )
-            if target_id in original_owner_data["contractors"]:
-                original_owner_data["contractors"].remove(target_id)
-
-            original_owner_data["coins"] += compensation
-            employer_data["coins"] -= total_cost
-
-            employer_data["contractors"].append(target_id)
-            target_data["contracted_by"] = user_id
-
-            self.purchase_data[target_id] = self.purchase_data.get(target_id, 0) + 1
-
-            await self._save_yaml_async(self.sign_data, DATA_FILE)
-            await self._save_yaml_async(self.purchase_data, PURCHASE_DATA_FILE)
-
-            target_name = await self._get_user_name_from_platform(event, target_id)
-            original_owner_name = await self._get_user_name_from_platform(
-                event, original_owner_id
+            target_name, original_owner_name = await self._get_user_names(
+                event, [target_id, original_owner_id]
             )
             yield event.plain_result(
                 f"恶意收购成功！您花费 {total_cost:.1f} 金币从 {original_owner_name} 手中抢走了 {target_name}。"
@@ -131,24 +224,64 @@ class ContractSystem(Star):
             )
             return
 
-        if employer_data["coins"] < total_cost:
-            yield event.plain_result(
-                f"现金不足，雇佣需要支付目标身价：{total_cost:.1f}金币。"
-            )
-            return
+        target_name = await self._get_user_name_from_platform(event, target_id)
+        yield event.plain_result(f"成功雇佣 {target_name}，消耗{total_cost:.1f}金币。")
 
-        employer_data["coins"] -= total_cost
-        employer_data["contractors"].append(target_id)
-        target_data["contracted_by"] = user_id
+    def _purchase_locked(
+        self, group_id: str, user_id: str, target_id: str, original_owner_id: str
+    ) -> tuple:
+        employer_data = self._get_user_data(self.sign_data, group_id, user_id)
+        target_data = self._get_user_data(self.sign_data, group_id, target_id)
 
-        self.purchase_data[target_id] = self.purchase_data.get(target_id, 0) + 1
-        await self._save_yaml_async(self.sign_data, DATA_FILE)
-        await self._save_yaml_async(self.purchase_data, PURCHASE_DATA_FILE)
+        if len(employer_data.contractors) >= 3:
+            raise TransactionError("已达到最大雇佣数量（3人）。")
 
-        target_name = await self._get_user_name_from_platform(event, target_id)
-        yield event.plain_result(f"成功雇佣 {target_name}，消耗{total_cost:.1f}金币。")
+        base_cost = self._derive(target_data, target_id)[3]
+        total_cost = base_cost
+        compensation = 0.0
+
+        with Transaction() as txn:
+            if original_owner_id:
+                if original_owner_id == user_id:
+                    raise TransactionError("该用户已经是您的雇员了。")
+
+                takeover_rate = self.config.get("takeover_fee_rate", 0.1)
+                extra_cost = base_cost * takeover_rate
+                total_cost += extra_cost
+                compensation = total_cost
+
+                if employer_data.coins < total_cost:
+                    raise TransactionError(
+                        f"现金不足，恶意收购需要支付 {total_cost:.1f} 金币（含{takeover_rate * 100}%额外费用）。"
+                    )
+
+                original_owner_data = self._get_user_data(
+                    self.sign_data, group_id, original_owner_id
+                )
+                txn.discard(original_owner_data, "contractors", target_id)
+                txn.add(original_owner_data, "coins", compensation)
+            elif employer_data.coins < total_cost:
+                raise TransactionError(
+                    f"现金不足，雇佣需要支付目标身价：{total_cost:.1f}金币。"
+                )
+
+            txn.add(employer_data, "coins", -total_cost, minimum=0.0)
+            txn.append(employer_data, "contractors", target_id)
+            txn.set(target_data, "contracted_by", user_id)
+            txn.add(self.purchase_data, target_id, 1)
+
+        self._log_trade(group_id, user_id, "purchase", -total_cost, peer=target_id)
+        if original_owner_id:
+            self._log_trade(
+                group_id, original_owner_id, "takeover", compensation, peer=user_id
+            )
+        self._persist_users(group_id, user_id, target_id, original_owner_id)
+        self._persist_purchase(target_id)
+        return total_cost, compensation
 
     @filter.regex(r"^出售")
+    @instrumented("sell")
+    @requires_data
     async def sell(self, event: AstrMessageEvent):
         target_id = None
         for component in event.message_obj.message:
@@ -162,102 +295,120 @@ class ContractSystem(Star):
 
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
+        await self._ensure_group(group_id)
 
-        employer_data = self._get_user_data(self.sign_data, group_id, user_id)
-        target_data = self._get_user_data(self.sign_data, group_id, target_id)
-        if target_id not in employer_data["contractors"]:
-            yield event.plain_result("该用户不在你的雇员列表中。")
+        try:
+            async with self._locks.hold(group_id, user_id, target_id):
+                sell_price = self._sell_locked(group_id, user_id, target_id)
+        except TransactionError as e:
+            yield event.plain_result(str(e))
             return
 
-        sell_rate = self.config.get("sell_return_rate", 0.8)
-        sell_price = (
-            self._calculate_dynamic_wealth_value(
-                target_data, self.purchase_data, target_id
-            )
-            * sell_rate
-        )
-        employer_data["coins"] += sell_price
-        employer_data["contractors"].remove(target_id)
-        target_data["contracted_by"] = None
-        await self._save_yaml_async(self.sign_data, DATA_FILE)
         target_name = await self._get_user_name_from_platform(event, target_id)
         yield event.plain_result(
             f"成功解雇 {target_name}，获得补偿金{sell_price:.1f}金币。"
         )
 
+    def _sell_locked(self, group_id: str, user_id: str, target_id: str) -> float:
+        employer_data = self._get_user_data(self.sign_data, group_id, user_id)
+        target_data = self._get_user_data(self.sign_data, group_id, target_id)
+        if target_id not in employer_data.contractors:
+            raise TransactionError("该用户不在你的雇员列表中。")
+
+        sell_rate = self.config.get("sell_return_rate", 0.8)
+        sell_price = self._derive(target_data, target_id)[3] * sell_rate
+        with Transaction() as txn:
+            txn.add(employer_data, "coins", sell_price)
+            txn.discard(employer_data, "contractors", target_id)
+            txn.set(target_data, "contracted_by", None)
+        self._log_trade(group_id, user_id, "sell", sell_price, peer=target_id)
+        self._persist_users(group_id, user_id, target_id)
+        return sell_price
+
     @filter.regex(r"^签到$")
+    @instrumented("sign_in")
+    @requires_data
     async def sign_in(self, event: AstrMessageEvent):
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
+        await self._ensure_group(group_id)
         user_data = self._get_user_data(self.sign_data, group_id, user_id)
         now = datetime.now(SHANGHAI_TZ)
         today = now.date()
-        if user_data["last_sign"]:
-            last_sign_dt = datetime.fromisoformat(user_data["last_sign"])
+        if user_data.last_sign:
+            last_sign_dt = datetime.fromisoformat(user_data.last_sign)
             last_sign_aware = SHANGHAI_TZ.localize(last_sign_dt)
             if last_sign_aware.date() == today:
                 yield event.plain_result("你今天已经签到过了，明天再来吧。")
                 return
             if (today - last_sign_aware.date()).days == 1:
-                user_data["consecutive"] += 1
+                user_data.consecutive += 1
             else:
-                user_data["consecutive"] = 1
+                user_data.consecutive = 1
         else:
-            user_data["consecutive"] = 1
-        interest = user_data["bank"] * 0.01
-        user_data["bank"] += interest
-        _, user_base_rate = self._get_wealth_info(user_data)
-
-        contractor_dynamic_rates = self._get_total_contractor_rate(
-            group_id, user_data["contractors"]
-        )
+            user_data.consecutive = 1
+        interest = 0.0
+        if not self.config.get("daily_settlement", False):
+            # 日结模式下利息已在零点统一发放
+            interest = user_data.bank * 0.01
+            user_data.bank += interest
+        _, _, user_base_rate, _ = self._derive(user_data, user_id)
+
+        contractor_dynamic_rates = self._settled_rates.get(group_id, {}).get(user_id)
+        if contractor_dynamic_rates is None:
+            contractor_dynamic_rates = self._get_total_contractor_rate(
+                group_id, user_data.contractors
+            )
 
-        consecutive_bonus = 10 * (user_data["consecutive"] - 1)
+        consecutive_bonus = 10 * (user_data.consecutive - 1)
         earned = (
             BASE_INCOME * (1 + user_base_rate) * (1 + contractor_dynamic_rates)
             + consecutive_bonus
         )
         original_earned = earned
         is_penalized = False
-        if user_data["contracted_by"]:
+        if user_data.contracted_by:
             income_rate = self.config.get("employed_income_rate", 0.7)
             earned *= income_rate
             is_penalized = True
-        user_data["coins"] += earned
-        user_data["last_sign"] = now.replace(tzinfo=None).isoformat()
-        await self._save_yaml_async(self.sign_data, DATA_FILE)
-        html_url = await self._generate_card_html(
-            event,
-            is_query=False,
-            is_penalized=is_penalized,
-            original_earned=original_earned,
-        )
+        user_data.coins += earned
+        user_data.last_sign = now.replace(tzinfo=None).isoformat()
+        self._log_trade(group_id, user_id, "sign_in", earned, interest)
+        self._persist_users(group_id, user_id)
+        try:
+            html_url = await self._generate_card_html(
+                event,
+                is_query=False,
+                is_penalized=is_penalized,
+                original_earned=original_earned,
+                interest=interest,
+            )
+        except RenderOverloaded as e:
+            yield event.plain_result(str(e))
+            return
         if html_url:
             yield event.image_result(html_url)
         else:
             yield event.plain_result("签到成功！但图片生成失败。")
 
     @filter.regex(r"^(排行榜|财富榜)$")
+    @instrumented("leaderboard")
+    @requires_data
     async def leaderboard(self, event: AstrMessageEvent):
         group_id = str(event.message_obj.group_id)
-        group_data = self.sign_data.get(group_id)
-        if not group_data:
-            yield event.plain_result("本群暂无签到数据，无法生成排行榜。")
-            return
-        all_users_wealth = []
-        for user_id, user_data in group_data.items():
-            total_wealth = user_data.get("coins", 0.0) + user_data.get("bank", 0.0)
-            all_users_wealth.append((user_id, total_wealth))
-        sorted_users = sorted(all_users_wealth, key=lambda item: item[1], reverse=True)
-        top_10_users = sorted_users[:10]
+        await self._ensure_group(group_id)
+        wealth_rank = self._wealth_ranks.get(group_id)
+        top_10_users = wealth_rank.top(10) if wealth_rank else []
         if not top_10_users:
             yield event.plain_result("本群暂无签到数据，无法生成排行榜。")
             return
-        user_ids_to_fetch = [user[0] for user in top_10_users]
-        name_coroutines = [
-            self._get_user_name_from_platform(event, uid) for uid in user_ids_to_fetch
-        ]
-        names = await asyncio.gather(*name_coroutines)
+        names = await self._get_user_names(event, [user[0] for user in top_10_users])
+
+        if self.config.get("leaderboard_image_mode", False):
+            image_url = await self._get_leaderboard_card(group_id, top_10_users, names)
+            if image_url:
+                yield event.image_result(image_url)
+                return
 
         leaderboard_str = "本群财富排行榜\n" + "-" * 20 + "\n"
         for rank, ((user_id, total_wealth), user_name) in enumerate(
@@ -265,53 +416,111 @@ class ContractSystem(Star):
         ):
             leaderboard_str += f"第{rank}名: {user_name} - {total_wealth:.1f} 金币\n"
 
+        user_id = str(event.get_sender_id())
+        my_rank = wealth_rank.rank(user_id)
+        if my_rank is not None:
+            leaderboard_str += (
+                "-" * 20
+                + f"\n你的排名: 第{my_rank}名 - {wealth_rank.score(user_id):.1f} 金币\n"
+            )
+
         yield event.plain_result(leaderboard_str.strip())
 
+    @filter.regex(r"^身价榜$")
+    @instrumented("value_board")
+    @requires_data
+    async def value_board(self, event: AstrMessageEvent):
+        group_id = str(event.message_obj.group_id)
+        await self._ensure_group(group_id)
+        value_rank = self._value_ranks.get(group_id)
+        top_10_users = value_rank.top(10) if value_rank else []
+        if not top_10_users:
+            yield event.plain_result("本群暂无签到数据，无法生成身价榜。")
+            return
+        names = await self._get_user_names(event, [user[0] for user in top_10_users])
+        group_data = self.sign_data.get(group_id, {})
+
+        board_str = "本群身价排行榜\n" + "-" * 20 + "\n"
+        for rank, ((user_id, value), user_name) in enumerate(
+            zip(top_10_users, names), start=1
+        ):
+            user_data = group_data.get(user_id)
+            level = self._derive(user_data, user_id)[1] if user_data else "平民"
+            board_str += f"第{rank}名: {user_name}（{level}）- 身价 {value:.1f} 金币\n"
+
+        user_id = str(event.get_sender_id())
+        my_rank = value_rank.rank(user_id)
+        if my_rank is not None:
+            board_str += (
+                "-" * 20
+                + f"\n你的排名: 第{my_rank}名 - 身价 {value_rank.score(user_id):.1f} 金币\n"
+            )
+
+        yield event.plain_result(board_str.strip())
+
     @filter.regex(r"^赎身$")
+    @instrumented("terminate_contract")
+    @requires_data
     async def terminate_contract(self, event: AstrMessageEvent):
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
-        user_data = self._get_user_data(self.sign_data, group_id, user_id)
-        if not user_data["contracted_by"]:
-            yield event.plain_result("您是自由身，无需赎身。")
+        await self._ensure_group(group_id)
+        try:
+            async with self._lock_trade(group_id, user_id, user_id) as employer_id:
+                cost, compensation = self._terminate_locked(
+                    group_id, user_id, employer_id
+                )
+        except TransactionError as e:
+            yield event.plain_result(str(e))
             return
 
-        cost = self._calculate_dynamic_wealth_value(
-            user_data, self.purchase_data, user_id
+        employer_name = await self._get_user_name_from_platform(event, employer_id)
+        yield event.plain_result(
+            f"赎身成功，消耗{cost:.1f}金币，重获自由！"
+            f"原雇主 {employer_name} 获得了 {compensation:.1f} 金币作为补偿。"
         )
-        if user_data["coins"] < cost:
-            yield event.plain_result(f"金币不足，需要支付赎身费用：{cost:.1f}金币。")
-            return
 
-        employer_id = user_data["contracted_by"]
-        employer_data = self._get_user_data(self.sign_data, group_id, employer_id)
+    def _terminate_locked(self, group_id: str, user_id: str, employer_id: str) -> tuple:
+        user_data = self._get_user_data(self.sign_data, group_id, user_id)
+        if not employer_id:
+            raise TransactionError("您是自由身，无需赎身。")
 
-        user_data["coins"] -= cost
-        if user_id in employer_data["contractors"]:
-            employer_data["contractors"].remove(user_id)
-        user_data["contracted_by"] = None
+        cost = self._derive(user_data, user_id)[3]
+        if user_data.coins < cost:
+            raise TransactionError(f"金币不足，需要支付赎身费用：{cost:.1f}金币。")
 
+        employer_data = self._get_user_data(self.sign_data, group_id, employer_id)
         redeem_rate = self.config.get("redeem_return_rate", 0.5)
         compensation = cost * redeem_rate
-        employer_data["coins"] += compensation
-
-        await self._save_yaml_async(self.sign_data, DATA_FILE)
 
-        employer_name = await self._get_user_name_from_platform(event, employer_id)
-        yield event.plain_result(
-            f"赎身成功，消耗{cost:.1f}金币，重获自由！"
-            f"原雇主 {employer_name} 获得了 {compensation:.1f} 金币作为补偿。"
-        )
+        with Transaction() as txn:
+            txn.add(user_data, "coins", -cost, minimum=0.0)
+            txn.discard(employer_data, "contractors", user_id)
+            txn.set(user_data, "contracted_by", None)
+            txn.add(employer_data, "coins", compensation)
+        self._log_trade(group_id, user_id, "redeem", -cost, peer=employer_id)
+        self._log_trade(group_id, employer_id, "redeemed", compensation, peer=user_id)
+        self._persist_users(group_id, user_id, employer_id)
+        return cost, compensation
 
     @filter.regex(r"^(我的信息|签到查询|我的资产)$")
+    @instrumented("sign_query")
+    @requires_data
     async def sign_query(self, event: AstrMessageEvent):
-        html_url = await self._generate_card_html(event, is_query=True)
+        await self._ensure_group(event.message_obj.group_id)
+        try:
+            html_url = await self._generate_card_html(event, is_query=True)
+        except RenderOverloaded as e:
+            yield event.plain_result(str(e))
+            return
         if html_url:
             yield event.image_result(html_url)
         else:
             yield event.plain_result("查询失败，图片生成服务出现问题。")
 
     @filter.regex(r"^(存款|存钱)\s+([0-9.]+)$")
+    @instrumented("deposit")
+    @requires_data
     async def deposit(self, event: AstrMessageEvent, amount_str: str):
         try:
             amount = float(amount_str)
@@ -323,16 +532,20 @@ class ContractSystem(Star):
             return
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
+        await self._ensure_group(group_id)
         user_data = self._get_user_data(self.sign_data, group_id, user_id)
-        if amount > user_data["coins"]:
-            yield event.plain_result(f"现金不足，当前现金：{user_data['coins']:.1f}")
+        if amount > user_data.coins:
+            yield event.plain_result(f"现金不足，当前现金：{user_data.coins:.1f}")
             return
-        user_data["coins"] -= amount
-        user_data["bank"] += amount
-        await self._save_yaml_async(self.sign_data, DATA_FILE)
+        user_data.coins -= amount
+        user_data.bank += amount
+        self._log_trade(group_id, user_id, "deposit", -amount, amount)
+        self._persist_users(group_id, user_id)
         yield event.plain_result(f"成功存入 {amount:.1f} 金币到银行。")
 
     @filter.regex(r"^(取款|取钱)\s+([0-9.]+)$")
+    @instrumented("withdraw")
+    @requires_data
     async def withdraw(self, event: AstrMessageEvent, amount_str: str):
         try:
             amount = float(amount_str)
@@ -344,150 +557,603 @@ class ContractSystem(Star):
             return
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
+        await self._ensure_group(group_id)
         user_data = self._get_user_data(self.sign_data, group_id, user_id)
-        if amount > user_data["bank"]:
-            yield event.plain_result(f"银行存款不足，当前存款：{user_data['bank']:.1f}")
+        if amount > user_data.bank:
+            yield event.plain_result(f"银行存款不足，当前存款：{user_data.bank:.1f}")
             return
-        user_data["bank"] -= amount
-        user_data["coins"] += amount
-        await self._save_yaml_async(self.sign_data, DATA_FILE)
+        user_data.bank -= amount
+        user_data.coins += amount
+        self._log_trade(group_id, user_id, "withdraw", amount, -amount)
+        self._persist_users(group_id, user_id)
         yield event.plain_result(f"成功取出 {amount:.1f} 金币。")
 
+    @filter.regex(r"^交易记录$")
+    @instrumented("trade_history")
+    @requires_data
+    async def trade_history(self, event: AstrMessageEvent):
+        group_id = str(event.message_obj.group_id)
+        user_id = str(event.get_sender_id())
+        await self._ensure_group(group_id)
+        entries = await self._ledger.recent(group_id, user_id, limit=10)
+        if not entries:
+            yield event.plain_result("暂无交易记录。")
+            return
+        peers = [entry[8] for entry in entries if entry[8]]
+        peer_names = dict(zip(peers, await self._get_user_names(event, peers)))
+
+        history_str = "你的最近交易记录\n" + "-" * 20 + "\n"
+        for timestamp, _, _, action, coins, bank, coins_after, _, peer in entries:
+            when = datetime.fromtimestamp(timestamp, SHANGHAI_TZ).strftime(
+                "%m-%d %H:%M"
+            )
+            changes = []
+            if coins:
+                changes.append(f"现金{coins:+.1f}")
+            if bank:
+                changes.append(f"存款{bank:+.1f}")
+            history_str += f"{when} {ACTION_LABELS.get(action, action)}"
+            if peer:
+                history_str += f"({peer_names.get(peer, peer)})"
+            history_str += f" {' '.join(changes)} 余额{coins_after:.1f}\n"
+
+        yield event.plain_result(history_str.strip())
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.regex(r"^签到统计$")
+    @instrumented("show_stats")
+    async def show_stats(self, event: AstrMessageEvent):
+        yield event.plain_result(self._format_stats(await self._collect_stats()))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.regex(r"^导出交易记录$")
+    @instrumented("export_ledger")
+    async def export_ledger(self, event: AstrMessageEvent):
+        group_id = str(event.message_obj.group_id)
+        file_name = (
+            f"ledger_{group_id}_{datetime.now(SHANGHAI_TZ).strftime('%Y%m%d_%H%M%S')}"
+            ".jsonl"
+        )
+        export_path = os.path.join(EXPORT_DIR, file_name)
+        try:
+            await asyncio.to_thread(os.makedirs, EXPORT_DIR, exist_ok=True)
+            count = await self._ledger.export(export_path, group_id)
+        except Exception as e:
+            logger.error(f"导出交易记录失败: {e}")
+            yield event.plain_result("导出交易记录失败，请查看日志。")
+            return
+        yield event.plain_result(f"已导出本群 {count} 条交易记录到 {export_path}")
+
     async def terminate(self):
+        if self._settlement_task is not None:
+            self._settlement_task.cancel()
+            await asyncio.gather(self._settlement_task, return_exceptions=True)
+        if self._export_task is not None:
+            self._export_task.cancel()
+            await asyncio.gather(self._export_task, return_exceptions=True)
+        await self._writer.close()
+        await self._ledger.close()
+        logger.info(f"签到插件数据已保存: {self._writer.stats}")
+        logger.info(f"签到卡片渲染统计: {self._render_scheduler.stats}")
+        if self._export_task is not None:
+            await self._export_metrics()
+        await self._bg_pool.close()
+        self._images.close()
+        self._local_renderer.close()
         await self.session.close()
 
-    async def _load_yaml_async(self, file_path: str) -> dict:
+    async def _load_all_data_to_cache(self):
         try:
-            async with aiofiles.open(file_path, "r", encoding="utf-8") as f:
-                content = await f.read()
-                return yaml.safe_load(content) or {}
-        except FileNotFoundError:
-            return {}
+            self.sign_data, self.purchase_data = await self._store.load()
+            await self._ledger.open()
+            for group_id in self.sign_data:
+                self._rebuild_wealth_rank(group_id)
+        except CheckpointError as e:
+            # 宁可停止服务也不能用空数据继续运行，否则下一次保存会覆盖全部存档
+            logger.error(f"签到数据快照全部损坏，插件已停止读写数据: {e}")
+            self._load_error = e
+            return
         except Exception as e:
-            logger.error(f"异步加载YAML文件失败 ({file_path}): {e}")
-            return {}
+            logger.error(f"加载签到数据失败，插件已停止读写数据: {e}")
+            self._load_error = e
+            return
+        finally:
+            # 无论成功与否都放行等待中的指令，失败时由 _load_error 拒绝服务
+            self._data_ready.set()
+        logger.info("签到插件数据已加载到缓存。")
+        if self.config.get("daily_settlement", False):
+            self._settlement_task = asyncio.create_task(self._settlement_loop())
+
+    def _create_store(self):
+        sharded = ShardedStore(
+            SHARD_DIR,
+            compact_interval=self.config.get("journal_compact_interval", 300),
+            compact_threshold=self.config.get("journal_compact_threshold", 2000),
+            snapshot_format=self.config.get("snapshot_format", "yaml"),
+            legacy_paths=(DATA_FILE, PURCHASE_DATA_FILE, JOURNAL_FILE),
+            keep_generations=self.config.get("snapshot_generations", 3),
+        )
+        if self.config.get("storage_backend", "yaml") == "sqlite":
+            return SqliteStore(SQLITE_FILE, legacy_source=sharded)
+        return sharded
+
+    async def _ensure_group(self, group_id: str):
+        group_id = str(group_id)
+        await self._data_ready.wait()
+        if self._load_error is not None:
+            raise self._load_error
+        self._group_access[group_id] = time.monotonic()
+        self._group_access.move_to_end(group_id)
+        task = self._group_loads.get(group_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_group(group_id))
+            self._group_loads[group_id] = task
+        try:
+            await task
+        except Exception:
+            self._group_loads.pop(group_id, None)
+            raise
+        self._maybe_evict_groups()
+
+    async def _load_group(self, group_id: str):
+        users = await self._store.load_group(group_id)
+        group_data = self.sign_data.setdefault(group_id, {})
+        merged = False
+        for user_id, user_data in users.items():
+            if user_id not in group_data:
+                group_data[user_id] = user_data
+                merged = True
+        if merged or group_id not in self._wealth_ranks:
+            self._rebuild_wealth_rank(group_id)
+
+    def _maybe_evict_groups(self):
+        budget = self.config.get("max_cached_users", 100000)
+        if budget <= 0 or self._settling:
+            return
+        if self._evict_task and not self._evict_task.done():
+            return
+        if sum(len(group_data) for group_data in self.sign_data.values()) > budget:
+            self._evict_task = asyncio.create_task(self._evict_idle_groups(budget))
+
+    async def _evict_idle_groups(self, budget: int):
+        # 按最近访问顺序卸载空闲的群，仍有待写入数据或正在交易的群跳过
+        idle_before = time.monotonic() - self.config.get("group_idle_seconds", 300)
+        cached = sum(len(group_data) for group_data in self.sign_data.values())
+        evicted = 0
+        for group_id, last_access in list(self._group_access.items()):
+            if cached <= budget or last_access > idle_before:
+                break
+            if self._writer.has_pending(group_id) or self._locks.holds_group(group_id):
+                continue
+            cached -= len(self.sign_data.pop(group_id, {}))
+            self._group_access.pop(group_id, None)
+            self._group_loads.pop(group_id, None)
+            self._wealth_ranks.pop(group_id, None)
+            self._value_ranks.pop(group_id, None)
+            self._leaderboard_cards.pop(group_id, None)
+            self._card_cache.invalidate_group(group_id)
+            try:
+                await self._store.evict_group(group_id)
+            except Exception as e:
+                logger.error(f"卸载群 {group_id} 的签到数据失败: {e}")
+            evicted += 1
+        if evicted:
+            logger.info(f"已卸载 {evicted} 个空闲群的签到数据，当前缓存 {cached} 人。")
+
+    async def _settlement_loop(self):
+        last_date = await asyncio.to_thread(self._read_settlement_date)
+        if last_date is None:
+            # 首次启用时今天的利息已在签到时发放，从明天零点开始日结
+            last_date = datetime.now(SHANGHAI_TZ).date().isoformat()
+            await asyncio.to_thread(
+                _write_text_atomic, SETTLEMENT_FILE, json.dumps({"date": last_date})
+            )
+        while True:
+            now = datetime.now(SHANGHAI_TZ)
+            if last_date != now.date().isoformat():
+                try:
+                    await self._run_settlement()
+                except Exception as e:
+                    logger.error(f"每日结算失败: {e}")
+                last_date = now.date().isoformat()
+            next_midnight = SHANGHAI_TZ.localize(
+                datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            )
+            await asyncio.sleep((next_midnight - now).total_seconds() + 1)
+
+    async def _run_settlement(self):
+        self._settling = True
+        started = time.perf_counter()
+        longest = 0.0
+        total = 0
+        try:
+            for group_id in await self._store.list_groups():
+                await self._ensure_group(group_id)
+            # 各群的结算互不影响，逐群同步计算，群之间让出事件循环，
+            # 避免零点签到高峰时整个事件循环被一次结算卡住
+            for group_id in list(self.sign_data):
+                group_data = self.sign_data.get(group_id)
+                if not group_data:
+                    continue
+                step = time.perf_counter()
+                # 只有存款不为零的用户资产会变化，其余用户的排行和存档都不用动
+                changed = [uid for uid, record in group_data.items() if record.bank]
+                rates = settle(
+                    {group_id: group_data},
+                    self.purchase_data,
+                    WEALTH_LEVELS,
+                    self._valuation.rate_bonus,
+                )
+                self._settled_rates[group_id] = rates.get(group_id, {})
+                self._update_ranks(group_id, changed)
+                self._card_cache.invalidate_group(group_id)
+                self._leaderboard_cards.pop(group_id, None)
+                total += len(group_data)
+                # 日志分批写入，每批之间都会回到事件循环
+                for i in range(0, len(changed), SETTLEMENT_CHUNK):
+                    self._writer.mark_users(group_id, changed[i : i + SETTLEMENT_CHUNK])
+                    longest = max(longest, time.perf_counter() - step)
+                    await self._writer.flush()
+                    step = time.perf_counter()
+                longest = max(longest, time.perf_counter() - step)
+                await asyncio.sleep(0)
+        finally:
+            self._settling = False
+        today = datetime.now(SHANGHAI_TZ).date().isoformat()
+        await asyncio.to_thread(
+            _write_text_atomic, SETTLEMENT_FILE, json.dumps({"date": today})
+        )
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"每日结算完成: {total} 人，总耗时 {elapsed * 1000:.0f}ms，"
+            f"单次最长占用事件循环 {longest * 1000:.0f}ms。"
+        )
 
-    async def _save_yaml_async(self, data: dict, file_path: str):
+    def _read_settlement_date(self):
         try:
-            async with aiofiles.open(file_path, "w", encoding="utf-8") as f:
-                content = yaml.dump(data, allow_unicode=True)
-                await f.write(content)
+            with open(SETTLEMENT_FILE, "r", encoding="utf-8") as f:
+                return json.load(f).get("date")
+        except FileNotFoundError:
+            return None
         except Exception as e:
-            logger.error(f"异步保存YAML文件失败 ({file_path}): {e}")
+            logger.warning(f"读取日结记录失败: {e}")
+            return None
+
+    def _rebuild_wealth_rank(self, group_id: str):
+        group_data = self.sign_data.get(group_id, {})
+        self._wealth_ranks[group_id] = RankIndex(
+            (user_id, user_data.total_wealth)
+            for user_id, user_data in group_data.items()
+        )
+        self._value_ranks[group_id] = RankIndex(
+            (user_id, self._derive(user_data, user_id)[3])
+            for user_id, user_data in group_data.items()
+        )
 
-    async def _load_all_data_to_cache(self):
-        self.sign_data = await self._load_yaml_async(DATA_FILE)
-        self.purchase_data = await self._load_yaml_async(PURCHASE_DATA_FILE)
-        logger.info("签到插件数据已加载到缓存。")
+    @asynccontextmanager
+    async def _lock_trade(self, group_id: str, user_id: str, target_id: str):
+        # 目标的雇主只会在持有目标锁时被修改，加锁后确认雇主未变，否则按新雇主重试
+        while True:
+            owner_id = self._get_user_data(
+                self.sign_data, group_id, target_id
+            ).contracted_by
+            async with self._locks.hold(group_id, user_id, target_id, owner_id):
+                current = self._get_user_data(self.sign_data, group_id, target_id)
+                if current.contracted_by == owner_id:
+                    yield owner_id
+                    return
+
+    def _persist_users(self, group_id: str, *user_ids: str):
+        group_id = str(group_id)
+        self._update_ranks(group_id, user_ids)
+        for user_id in user_ids:
+            self._card_cache.invalidate(group_id, user_id)
+            # 雇员变动后日结时算好的加成不再适用
+            self._settled_rates.get(group_id, {}).pop(user_id, None)
+        self._writer.mark_users(group_id, user_ids)
+
+    def _update_ranks(self, group_id: str, user_ids):
+        group_data = self.sign_data.get(group_id, {})
+        users = [
+            (user_id, group_data[user_id])
+            for user_id in user_ids
+            if user_id in group_data
+        ]
+        self._wealth_ranks.setdefault(group_id, RankIndex()).update_many(
+            (user_id, user_data.total_wealth) for user_id, user_data in users
+        )
+        self._value_ranks.setdefault(group_id, RankIndex()).update_many(
+            (user_id, self._derive(user_data, user_id)[3])
+            for user_id, user_data in users
+        )
+
+    def _log_trade(
+        self,
+        group_id: str,
+        user_id: str,
+        action: str,
+        coins: float = 0.0,
+        bank: float = 0.0,
+        peer: str = None,
+    ):
+        user_data = self._get_user_data(self.sign_data, group_id, user_id)
+        self._ledger.record(
+            group_id,
+            user_id,
+            action,
+            coins,
+            bank,
+            user_data.coins,
+            user_data.bank,
+            peer,
+        )
+
+    def _persist_purchase(self, user_id: str):
+        # 被购买次数不分群，该用户所在的每个群的身价榜都要更新
+        for group_id, group_data in self.sign_data.items():
+            user_data = group_data.get(user_id)
+            if user_data is not None and group_id in self._value_ranks:
+                self._value_ranks[group_id].update(
+                    user_id, self._derive(user_data, user_id)[3]
+                )
+        self._writer.mark_purchase(user_id)
+
+    def _lookup_user(self, group_id: str, user_id: str):
+        return self.sign_data.get(group_id, {}).get(user_id)
+
+    def _lookup_purchase(self, user_id: str) -> int:
+        return self.purchase_data.get(user_id, 0)
+
+    async def _collect_stats(self) -> dict:
+        caches = {
+            "names": self._names.stats,
+            "avatars": self._avatar_cache.stats,
+            "cards": self._card_cache.stats,
+            "images": self._images.stats,
+            "backgrounds": {
+                "hits": self._bg_pool.hits,
+                "misses": self._bg_pool.misses,
+                "pooled": len(self._bg_pool),
+            },
+        }
+        for stats in caches.values():
+            stats["hit_rate"] = hit_rate(stats)
+        return {
+            **self._metrics.snapshot(),
+            "caches": caches,
+            "writer": self._writer.stats,
+            "storage": self._store.stats,
+            "ledger": self._ledger.stats,
+            "render_queue": self._render_scheduler.stats,
+            "render": self._renderer.stats,
+            "memory": {
+                "groups": len(self.sign_data),
+                "users": sum(len(group_data) for group_data in self.sign_data.values()),
+            },
+            "data_files": await asyncio.to_thread(directory_sizes, DATA_DIR),
+        }
+
+    def _format_stats(self, stats: dict) -> str:
+        lines = [f"签到插件统计（已运行 {stats['uptime_s'] / 3600:.1f} 小时）"]
+        for prefix, title in (("handler.", "命令"), ("stage.", "阶段")):
+            lines.append(f"[{title}]")
+            for name, summary in stats["latency"].items():
+                if not name.startswith(prefix):
+                    continue
+                errors = stats["errors"].get(name, 0)
+                lines.append(
+                    f"{name[len(prefix) :]}: {summary['count']}次 "
+                    f"p50 {_ms_text(summary['p50_ms'])} "
+                    f"p95 {_ms_text(summary['p95_ms'])} "
+                    f"最大 {_ms_text(summary['max_ms'])}"
+                    + (f" 失败 {errors}次" if errors else "")
+                )
+        lines.append("[缓存命中率]")
+        lines.append(
+            " | ".join(
+                f"{name} {_percent(cache['hit_rate'])}"
+                for name, cache in stats["caches"].items()
+            )
+        )
+        queue = stats["render_queue"]
+        lines.append("[渲染]")
+        lines.append(
+            f"排队 {queue['waiting']} 渲染中 {queue['running']} "
+            f"已丢弃 {queue['dropped']} 等待p95 {_ms_text(queue['wait_p95_ms'])} "
+            f"对冲 {stats['render']['hedged']}次"
+        )
+        for name, endpoint in stats["render"]["endpoints"].items():
+            lines.append(
+                f"{name}: {endpoint['state']} {endpoint['calls']}次 "
+                f"错误率 {_percent(endpoint['error_rate'])} "
+                f"p95 {_ms_text(endpoint['p95_ms'])}"
+            )
+        lines.append("[数据]")
+        lines.append(
+            f"内存中 {stats['memory']['groups']} 个群 {stats['memory']['users']} 人，"
+            f"待写入 {stats['writer']['pending_users']} 人"
+        )
+        lines.append(
+            " | ".join(
+                f"{name} {size / 1024:.1f}KB"
+                for name, size in sorted(stats["data_files"].items())
+            )
+            or "无数据文件"
+        )
+        return "\n".join(lines)
+
+    async def _export_metrics_loop(self):
+        interval = self.config.get("metrics_export_interval", 60)
+        while True:
+            await asyncio.sleep(interval)
+            await self._export_metrics()
+
+    async def _export_metrics(self):
+        try:
+            stats = await self._collect_stats()
+            if self.config.get("metrics_export", "off") == "prometheus":
+                path = os.path.join(DATA_DIR, "metrics.prom")
+                content = self._metrics.prometheus(
+                    {
+                        key: value
+                        for key, value in stats.items()
+                        if isinstance(value, dict) and key not in ("latency", "errors")
+                    }
+                )
+            else:
+                path = os.path.join(DATA_DIR, "metrics.json")
+                content = json.dumps(stats, ensure_ascii=False, indent=2)
+            await asyncio.to_thread(_write_text_atomic, path, content)
+        except Exception as e:
+            logger.warning(f"导出签到插件统计失败: {e}")
 
     def _init_env(self):
         os.makedirs(DATA_DIR, exist_ok=True)
-        if not os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "w", encoding="utf-8") as f:
-                yaml.dump({}, f)
-        if not os.path.exists(PURCHASE_DATA_FILE):
-            with open(PURCHASE_DATA_FILE, "w", encoding="utf-8") as f:
-                yaml.dump({}, f)
         if not os.path.exists(self.font_path):
             logger.warning(f"字体文件缺失: {self.font_path}")
-        if not os.path.exists(self.template_path):
-            logger.error(f"HTML模板文件缺失: {self.template_path}")
+        for template_path in (self.template_path, self.leaderboard_template_path):
+            if not os.path.exists(template_path):
+                logger.error(f"HTML模板文件缺失: {template_path}")
         if not os.path.exists(self.default_bg_path):
             logger.warning(f"备用背景图文件缺失: {self.default_bg_path}")
 
-    def _get_user_data(self, data_cache: dict, group_id: str, user_id: str) -> dict:
-        return data_cache.setdefault(str(group_id), {}).setdefault(
-            str(user_id),
-            {
-                "coins": 0.0,
-                "bank": 0.0,
-                "contractors": [],
-                "contracted_by": None,
-                "last_sign": None,
-                "consecutive": 0,
-            },
-        )
-
-    def _get_wealth_info(self, user_data: dict) -> tuple:
-        total = user_data.get("coins", 0.0) + user_data.get("bank", 0.0)
-        for min_coin, name, rate in reversed(WEALTH_LEVELS):
-            if total >= min_coin:
-                return name, rate
-        return "平民", 0.25
-
-    def _calculate_dynamic_wealth_value(
-        self, user_data: dict, purchase_counts: dict, user_id: str
-    ) -> float:
-        total = user_data.get("coins", 0.0) + user_data.get("bank", 0.0)
-        base_value = WEALTH_BASE_VALUES["平民"]
-        for min_coin, name, _ in reversed(WEALTH_LEVELS):
-            if total >= min_coin:
-                base_value = WEALTH_BASE_VALUES[name]
-                break
-        contract_level = purchase_counts.get(str(user_id), 0)
-        price_bonus = self.config.get("contract_level_price_bonus", 0.15)
-        return base_value * (1 + contract_level * price_bonus)
+    def _get_user_data(
+        self, data_cache: dict, group_id: str, user_id: str
+    ) -> UserRecord:
+        group_data = data_cache.get(group_id)
+        if group_data is None:
+            group_data = data_cache.setdefault(sys.intern(str(group_id)), {})
+        user_data = group_data.get(user_id)
+        if user_data is None:
+            user_data = group_data[sys.intern(str(user_id))] = UserRecord()
+        return user_data
+
+    def _derive(self, user_data: UserRecord, user_id: str) -> tuple:
+        # (总资产, 档位名, 档位加成, 身价)
+        return self._valuation.derive(user_data, self.purchase_data.get(user_id, 0))
 
     def _get_total_contractor_rate(self, group_id: str, contractor_ids: list) -> float:
         total_rate = 0.0
-        rate_bonus = self.config.get("contract_level_rate_bonus", 0.075)
         for contractor_id in contractor_ids:
             contractor_data = self._get_user_data(
                 self.sign_data, group_id, contractor_id
             )
-            _, base_rate = self._get_wealth_info(contractor_data)
-            contract_level = self.purchase_data.get(contractor_id, 0)
-            total_rate += base_rate + (contract_level * rate_bonus)
+            total_rate += self._valuation.contractor_rate(
+                contractor_data, self.purchase_data.get(contractor_id, 0)
+            )
         return total_rate
 
     async def _get_user_name_from_platform(
         self, event: AstrMessageEvent, target_id: str
     ) -> str:
-        if event.get_platform_name() == "aiocqhttp":
-            try:
-                from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
-                    AiocqhttpMessageEvent,
-                )
+        with self._metrics.timer("stage.resolve_names"):
+            return await self._names.resolve(
+                event, event.message_obj.group_id, target_id
+            )
 
-                if isinstance(event, AiocqhttpMessageEvent):
-                    client = event.bot
-                    resp = await client.api.call_action(
-                        "get_group_member_info",
-                        group_id=event.message_obj.group_id,
-                        user_id=int(target_id),
-                        no_cache=True,
-                    )
-                    return resp.get("card") or resp.get(
-                        "nickname", f"用户{target_id[-4:]}"
-                    )
-            except Exception as e:
-                logger.warning(f"通过API获取用户信息({target_id})失败: {e}")
-        return f"用户{target_id[-4:]}"
+    async def _get_user_names(self, event: AstrMessageEvent, user_ids: list) -> list:
+        with self._metrics.timer("stage.resolve_names"):
+            return await self._names.resolve_many(
+                event, event.message_obj.group_id, user_ids
+            )
+
+    def _get_aiocqhttp_client(self, event: AstrMessageEvent):
+        if event.get_platform_name() != "aiocqhttp":
+            return None
+        from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
+            AiocqhttpMessageEvent,
+        )
+
+        if isinstance(event, AiocqhttpMessageEvent):
+            return event.bot
+        return None
 
-    async def _image_to_base64(self, url: str) -> str:
+    async def _fetch_member_name(self, event: AstrMessageEvent, target_id: str):
+        try:
+            client = self._get_aiocqhttp_client(event)
+            if client is None:
+                return None
+            resp = await client.api.call_action(
+                "get_group_member_info",
+                group_id=event.message_obj.group_id,
+                user_id=int(target_id),
+                no_cache=True,
+            )
+            return resp.get("card") or resp.get("nickname")
+        except Exception as e:
+            logger.warning(f"通过API获取用户信息({target_id})失败: {e}")
+            return None
+
+    async def _fetch_member_names(self, event: AstrMessageEvent) -> dict:
+        try:
+            client = self._get_aiocqhttp_client(event)
+            if client is None:
+                return {}
+            members = await client.api.call_action(
+                "get_group_member_list", group_id=event.message_obj.group_id
+            )
+            return {
+                str(member["user_id"]): member.get("card") or member.get("nickname")
+                for member in members or []
+                if member.get("card") or member.get("nickname")
+            }
+        except Exception as e:
+            logger.warning(f"通过API获取群成员列表失败: {e}")
+            return {}
+
+    async def _download_image(self, url: str):
+        with self._metrics.timer("stage.download_image"):
+            return await self._fetch_image(url)
+
+    async def _fetch_image(self, url: str):
         try:
             async with self.session.get(url) as response:
                 if response.status == 200:
                     image_bytes = await response.read()
-                    encoded_string = base64.b64encode(image_bytes).decode("utf-8")
-                    return f"data:{response.headers.get('Content-Type', 'image/jpeg')};base64,{encoded_string}"
+                    return image_bytes, response.headers.get(
+                        "Content-Type", "image/jpeg"
+                    )
                 else:
                     logger.error(f"下载图片失败 ({url})，状态码: {response.status}")
-                    return ""
+                    return None
         except Exception as e:
-            logger.error(f"下载或转换图片时发生异常 ({url}): {e}")
-            return ""
+            logger.error(f"下载图片时发生异常 ({url}): {e}")
+            return None
+
+    async def _fetch_background(self):
+        bg_api_url = self.config.get("bg_api_url", "https://t.alcy.cc/ycy")
+        image = await self._download_image(bg_api_url)
+        if image is None:
+            return None
+        # 预取时就缩放好，渲染时直接使用；每张背景只用一次，不进缓存
+        with self._metrics.timer("stage.prepare_image"):
+            return await self._images.prepare(image, CARD_SIZE, cache=False)
+
+    async def _card_background(self):
+        background = self._bg_pool.pop()
+        if background is None and self.default_bg:
+            with self._metrics.timer("stage.prepare_image"):
+                background = await self._images.prepare(self.default_bg, CARD_SIZE)
+        return background
+
+    async def _prepared_avatar(self, user_id: str, size: int):
+        avatar = await self._avatar_cache.get_entry(user_id)
+        if avatar is None:
+            return None
+        with self._metrics.timer("stage.prepare_image"):
+            return await self._images.prepare(
+                (avatar.data, avatar.mime), (size, size), crop=True
+            )
 
-    def _file_to_base64(self, file_path: str) -> str:
+    def _read_image_file(self, file_path: str):
         if not os.path.exists(file_path):
-            return ""
+            return None
         try:
             with open(file_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-                return f"data:image/jpeg;base64,{encoded_string}"
+                return image_file.read(), "image/jpeg"
         except Exception as e:
             logger.error(f"读取本地图片文件失败 ({file_path}): {e}")
-            return ""
+            return None
 
     async def _generate_card_html(
         self,
@@ -495,55 +1161,41 @@ class ContractSystem(Star):
         is_query: bool,
         is_penalized: bool = False,
         original_earned: float = 0.0,
+        interest: float = 0.0,
     ) -> str:
-        bg_api_url = self.config.get("bg_api_url", "https://t.alcy.cc/ycy")
-        bg_image_data = await self._image_to_base64(bg_api_url)
-        if not bg_image_data:
-            bg_image_data = self._file_to_base64(self.default_bg_path)
-
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
+        await self._ensure_group(group_id)
         user_data = self._get_user_data(self.sign_data, group_id, user_id)
-        avatar_data = await self._image_to_base64(AVATAR_API.format(user_id))
-        font_path = (
-            f"file://{os.path.abspath(self.font_path)}"
-            if os.path.exists(self.font_path)
-            else ""
-        )
-        wealth_level, user_base_rate = self._get_wealth_info(user_data)
+        _, wealth_level, user_base_rate, _ = self._derive(user_data, user_id)
 
         render_data = {
-            "font_path": font_path,
-            "bg_image_data": bg_image_data,
-            "avatar_data": avatar_data,
+            "font_path": self._font_url(),
             "user_id": user_id,
             "user_name": event.get_sender_name(),
-            "status": "受雇" if user_data["contracted_by"] else "自由",
+            "status": "受雇" if user_data.contracted_by else "自由",
             "wealth_level": wealth_level,
             "time_title": "查询时间" if is_query else "签到时间",
             "current_time": datetime.now(SHANGHAI_TZ).strftime("%Y-%m-%d %H:%M:%S"),
             "income_title": "明日预计收入" if is_query else "今日总收益",
-            "coins": user_data["coins"],
-            "bank": user_data["bank"],
-            "consecutive": user_data["consecutive"],
+            "coins": user_data.coins,
+            "bank": user_data.bank,
+            "consecutive": user_data.consecutive,
             "is_query": is_query,
             "is_penalized": is_penalized,
             "original_earned": original_earned,
         }
 
         if is_query:
-            names = [
-                await self._get_user_name_from_platform(event, uid)
-                for uid in user_data["contractors"]
-            ]
+            names = await self._get_user_names(event, user_data.contractors)
             render_data["contractors_display"] = ", ".join(names) if names else "无"
             base_with_bonus = BASE_INCOME * (1 + user_base_rate)
             contractor_dynamic_rates = self._get_total_contractor_rate(
-                group_id, user_data["contractors"]
+                group_id, user_data.contractors
             )
             contract_bonus = base_with_bonus * contractor_dynamic_rates
-            consecutive_bonus = 10 * user_data["consecutive"]
-            tomorrow_interest = user_data["bank"] * 0.01
+            consecutive_bonus = 10 * user_data.consecutive
+            tomorrow_interest = user_data.bank * 0.01
             render_data.update(
                 {
                     "total_income": base_with_bonus
@@ -557,25 +1209,198 @@ class ContractSystem(Star):
                 }
             )
         else:
-            render_data["contractors_display"] = str(len(user_data["contractors"]))
-            interest = user_data["bank"] * 0.01
+            render_data["contractors_display"] = str(len(user_data.contractors))
             earned = original_earned
             if is_penalized:
                 income_rate = self.config.get("employed_income_rate", 0.7)
                 earned *= income_rate
             render_data.update({"earned": earned + interest, "interest": interest})
 
+        # 查询卡片的指纹包含全部文字内容，时间精确到分钟；背景和头像不参与
+        fingerprint = None
+        if is_query:
+            fingerprint = tuple(
+                sorted(
+                    (key, value)
+                    for key, value in render_data.items()
+                    if key != "current_time"
+                )
+            ) + (render_data["current_time"][:16],)
+            cached = self._card_cache.get(group_id, user_id, fingerprint)
+            if cached:
+                return cached
+
+        card_name = f"{'query' if is_query else 'sign'}_{group_id}_{user_id}"
         try:
-            return await self.html_render(self.html_template, render_data)
-        except Exception as e:
-            logger.error(f"HTML 渲染失败: {e}")
+            image_url = await self._render_scheduler.run(
+                partial(self._render_user_card, card_name, render_data, user_id)
+            )
+        except RenderOverloaded:
+            raise RenderOverloaded(self._card_text(render_data)) from None
+        if image_url and fingerprint is not None:
+            self._card_cache.put(group_id, user_id, fingerprint, image_url)
+        return image_url
+
+    async def _get_leaderboard_card(
+        self, group_id: str, top_users: list, names: list
+    ) -> str:
+        # 只有前十名的成员或数值变化时才重新渲染，否则直接复用上次的图片
+        cache_key = tuple((user_id, round(wealth, 1)) for user_id, wealth in top_users)
+        cached = self._leaderboard_cards.get(group_id)
+        if cached and cached[0] == cache_key:
+            return cached[1]
+
+        avatars = await asyncio.gather(
+            *(
+                self._prepared_avatar(user_id, LEADERBOARD_AVATAR_SIZE)
+                for user_id, _ in top_users
+            )
+        )
+        background = await self._card_background()
+        render_data = {
+            "font_path": self._font_url(),
+            "bg_image_data": data_uri(*background) if background else "",
+            "current_time": datetime.now(SHANGHAI_TZ).strftime("%Y-%m-%d %H:%M:%S"),
+            "rows": [
+                {
+                    "rank": rank,
+                    "name": name,
+                    "wealth": wealth,
+                    "avatar_data": data_uri(*avatar) if avatar else "",
+                }
+                for rank, ((_, wealth), name, avatar) in enumerate(
+                    zip(top_users, names, avatars), start=1
+                )
+            ],
+        }
+        try:
+            image_url = await self._render_scheduler.run(
+                partial(self._render_card, self.leaderboard_template, render_data)
+            )
+        except RenderOverloaded:
             return ""
+        if image_url:
+            self._leaderboard_cards[group_id] = (cache_key, image_url)
+        return image_url
+
+    async def _render_user_card(
+        self, card_name: str, render_data: dict, user_id: str
+    ) -> str:
+        with self._metrics.timer("stage.avatar"):
+            avatar = await self._prepared_avatar(user_id, AVATAR_SIZE)
+        job = RenderJob(
+            self.html_template,
+            render_data,
+            card_name=card_name,
+            background=await self._card_background(),
+            avatar=avatar,
+        )
+        with self._metrics.timer("stage.render"):
+            return await self._renderer.render(job)
+
+    def _card_text(self, render_data: dict) -> str:
+        # 渲染繁忙时代替卡片的纯文字版本，数据已经保存，不受影响
+        lines = []
+        if render_data["is_query"]:
+            lines.append(
+                f"身份: {render_data['status']} | 等级: {render_data['wealth_level']}"
+            )
+            lines.append(f"明日预计收入: {render_data['total_income']:.1f} 金币")
+        else:
+            lines.append(
+                f"签到成功！获得 {render_data['earned']:.1f} 金币"
+                f"（含利息{render_data['interest']:.1f}）"
+            )
+        lines.append(
+            f"现金: {render_data['coins']:.1f} | 银行: {render_data['bank']:.1f}"
+        )
+        lines.append(
+            f"雇员: {render_data['contractors_display']} | "
+            f"连续签到: {render_data['consecutive']} 天"
+        )
+        lines.append("（图片生成繁忙，已改为文字回复）")
+        return "\n".join(lines)
+
+    async def _render_card(self, template: str, render_data: dict) -> str:
+        with self._metrics.timer("stage.render"):
+            return await self._renderer.render(RenderJob(template, render_data))
+
+    def _create_renderer(self) -> RenderDispatcher:
+        options = {
+            "failure_threshold": self.config.get("render_failure_threshold", 3),
+            "cooldown": self.config.get("render_cooldown", 30),
+        }
+        framework = RenderEndpoint(
+            "html_render", self._render_with_framework, **options
+        )
+        remote = [
+            RenderEndpoint(url, partial(self._render_with_endpoint, url), **options)
+            for url in self.config.get("render_endpoints", [])
+            if url
+        ]
+        # 本地渲染只实现了签到卡片的布局，作为最后的备用端点
+        local = RenderEndpoint(
+            "local",
+            self._render_locally,
+            supports=lambda job: job.card_name is not None,
+            **options,
+        )
+        if self.config.get("render_mode", "html") == "local":
+            endpoints = [local, framework, *remote]
+        else:
+            endpoints = [framework, *remote, local]
+        return RenderDispatcher(
+            endpoints,
+            timeout=self.config.get("render_timeout", 15),
+            hedge_percentile=self.config.get("render_hedge_percentile", 0.95),
+        )
+
+    async def _render_with_framework(self, job: RenderJob) -> str:
+        return await self.html_render(job.template, job.html_data())
+
+    async def _render_with_endpoint(self, url: str, job: RenderJob) -> str:
+        strategy = self._render_strategies.get(url)
+        if strategy is None:
+            from astrbot.core.utils.t2i.network_strategy import NetworkRenderStrategy
+
+            strategy = self._render_strategies[url] = NetworkRenderStrategy(url)
+        return await strategy.render_custom_template(
+            job.template, job.html_data(), return_url=True
+        )
+
+    async def _render_locally(self, job: RenderJob) -> str:
+        return await self._local_renderer.render(
+            job.card_name,
+            job.render_data,
+            job.background[0] if job.background else b"",
+            job.avatar[0] if job.avatar else b"",
+        )
+
+    def _font_url(self) -> str:
+        if os.path.exists(self.font_path):
+            return f"file://{os.path.abspath(self.font_path)}"
+        return ""
 
-    def _load_template(self) -> str:
-        if os.path.exists(self.template_path):
+    def _load_template(self, template_path: str) -> str:
+        if os.path.exists(template_path):
             try:
-                with open(self.template_path, "r", encoding="utf-8") as f:
+                with open(template_path, "r", encoding="utf-8") as f:
                     return f.read()
             except Exception as e:
                 logger.error(f"读取HTML模板文件失败: {e}")
         return "<h1>模板文件加载失败</h1>"
+
+
+def _percent(value) -> str:
+    return "-" if value is None else f"{value * 100:.0f}%"
+
+
+def _ms_text(value) -> str:
+    return "-" if value is None else f"{value}ms"
+
+
+def _write_text_atomic(path: str, content: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
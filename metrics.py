@@ -0,0 +1,191 @@
+import functools
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 延迟分桶上限（秒），最后一个桶为 +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """固定分桶的延迟直方图，分位数在所在桶内按线性插值估算。"""
+
+    __slots__ = ("buckets", "count", "max", "sum")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percentile: float):
+        if not self.count:
+            return None
+        # 在目标所在的桶内线性插值
+        target = percentile * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= target:
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                upper = (
+                    min(self.max, LATENCY_BUCKETS[index])
+                    if index < len(LATENCY_BUCKETS)
+                    else self.max
+                )
+                return lower + (upper - lower) * max(0.0, target - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": _ms(self.sum / self.count) if self.count else None,
+            "p50_ms": _ms(self.percentile(0.5)),
+            "p95_ms": _ms(self.percentile(0.95)),
+            "max_ms": _ms(self.max) if self.count else None,
+        }
+
+
+class Metrics:
+    """命令处理和各热点阶段的延迟统计。"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.errors = {}
+        self.started_at = time.time()
+
+    def observe(self, name: str, seconds: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def error(self, name: str):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(name)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "latency": {
+                name: histogram.summary()
+                for name, histogram in sorted(self.histograms.items())
+            },
+            "errors": dict(sorted(self.errors.items())),
+        }
+
+    def prometheus(self, gauges: dict) -> str:
+        lines = ["# TYPE qsign_latency_seconds histogram"]
+        for name, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), histogram.buckets):
+                cumulative += count
+                lines.append(
+                    f'qsign_latency_seconds_bucket{{name="{name}",le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(f'qsign_latency_seconds_sum{{name="{name}"}} {histogram.sum}')
+            lines.append(
+                f'qsign_latency_seconds_count{{name="{name}"}} {histogram.count}'
+            )
+        lines.append("# TYPE qsign_errors_total counter")
+        for name, count in sorted(self.errors.items()):
+            lines.append(f'qsign_errors_total{{name="{name}"}} {count}')
+        lines.append("# TYPE qsign_stat gauge")
+        for section, values in sorted(gauges.items()):
+            for key, value in sorted(_flatten(values).items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f'qsign_stat{{section="{section}",key="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def instrumented(name: str):
+    """记录命令处理器从收到消息到产生第一条回复的耗时。"""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            observed = False
+            try:
+                async for result in handler(self, *args, **kwargs):
+                    if not observed:
+                        observed = True
+                        self._metrics.observe(
+                            f"handler.{name}", time.perf_counter() - started
+                        )
+                    yield result
+            except Exception:
+                self._metrics.error(f"handler.{name}")
+                raise
+            finally:
+                if not observed:
+                    self._metrics.observe(
+                        f"handler.{name}", time.perf_counter() - started
+                    )
+
+        return wrapper
+
+    return decorator
+
+
+def hit_rate(stats: dict):
+    total = stats.get("hits", 0) + stats.get("misses", 0)
+    return round(stats.get("hits", 0) / total, 3) if total else None
+
+
+def directory_sizes(root: str) -> dict:
+    """按顶层条目统计数据目录占用的字节数，子目录计入其总和。"""
+    sizes = {}
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return sizes
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            total = 0
+            for dir_path, _, file_names in os.walk(entry.path):
+                for file_name in file_names:
+                    try:
+                        total += os.path.getsize(os.path.join(dir_path, file_name))
+                    except OSError:
+                        pass
+            sizes[entry.name] = total
+        else:
+            try:
+                sizes[entry.name] = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+    return sizes
+
+
+def _flatten(values: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
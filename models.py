@@ -0,0 +1,57 @@
+import sys
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class UserRecord:
+    """单个群成员的签到数据。
+
+    使用 __slots__ 代替每人一个六键 dict；雇员列表存为元组，
+    用户 ID 字符串经过驻留，与群数据中的键共享同一对象。
+    tier 缓存身价档位的序号，由 Valuation 维护，不参与持久化。
+    """
+
+    coins: float = 0.0
+    bank: float = 0.0
+    contractors: tuple = ()
+    contracted_by: str = None
+    last_sign: str = None
+    consecutive: int = 0
+    tier: int = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def total_wealth(self) -> float:
+        return self.coins + self.bank
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserRecord":
+        contracted_by = data.get("contracted_by")
+        return cls(
+            float(data.get("coins", 0.0)),
+            float(data.get("bank", 0.0)),
+            tuple(sys.intern(str(uid)) for uid in data.get("contractors") or ()),
+            sys.intern(str(contracted_by)) if contracted_by else None,
+            data.get("last_sign"),
+            int(data.get("consecutive", 0)),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "coins": self.coins,
+            "bank": self.bank,
+            "contractors": list(self.contractors),
+            "contracted_by": self.contracted_by,
+            "last_sign": self.last_sign,
+            "consecutive": self.consecutive,
+        }
+
+
+def records_from_dict(sign_data: dict) -> dict:
+    return {
+        sys.intern(str(group_id)): {
+            sys.intern(str(user_id)): UserRecord.from_dict(record)
+            for user_id, record in group_data.items()
+        }
+        for group_id, group_data in (sign_data or {}).items()
+        if isinstance(group_data, dict)
+    }
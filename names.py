@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+def fallback_name(user_id: str) -> str:
+    return f"用户{str(user_id)[-4:]}"
+
+
+class NameResolver:
+    """按群缓存群成员昵称。
+
+    需要一次解析较多用户时，先用一次群成员列表请求预热整个群；
+    同一用户的并发查询共享一次接口调用。接口失败时返回占位名且不缓存。
+    过期的昵称在查询或预热时清除，缓存的总条目数超过 max_entries 时
+    按群的最近访问顺序整群淘汰。
+    """
+
+    def __init__(
+        self,
+        fetch_member,
+        fetch_member_list,
+        ttl: float = 600.0,
+        batch_threshold: int = 3,
+        max_entries: int = 50000,
+    ):
+        self._fetch_member = fetch_member
+        self._fetch_member_list = fetch_member_list
+        self.ttl = ttl
+        self.batch_threshold = batch_threshold
+        self.max_entries = max_entries
+
+        self._cache = OrderedDict()
+        self._entries = 0
+        self._inflight = {}
+        self._warm_inflight = {}
+        self._warmed_at = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self.evictions = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "api_calls": self.api_calls,
+            "groups": len(self._cache),
+            "entries": self._entries,
+            "evictions": self.evictions,
+        }
+
+    async def resolve(self, event, group_id: str, user_id: str) -> str:
+        return (await self.resolve_many(event, group_id, [user_id]))[0]
+
+    async def resolve_many(self, event, group_id: str, user_ids: list) -> list:
+        group_id = str(group_id)
+        user_ids = [str(uid) for uid in user_ids]
+        missing = [
+            uid for uid in dict.fromkeys(user_ids) if not self._cached(group_id, uid)
+        ]
+        self.hits += len(user_ids) - len(missing)
+        self.misses += len(missing)
+
+        if len(missing) >= self.batch_threshold:
+            await self._warm_group(event, group_id)
+            missing = [uid for uid in missing if not self._cached(group_id, uid)]
+
+        if missing:
+            await asyncio.gather(
+                *(self._resolve_one(event, group_id, uid) for uid in missing)
+            )
+        return [self._cached(group_id, uid) or fallback_name(uid) for uid in user_ids]
+
+    def _cached(self, group_id: str, user_id: str):
+        group = self._cache.get(group_id)
+        entry = group.get(user_id) if group else None
+        if entry is None:
+            return None
+        self._cache.move_to_end(group_id)
+        if entry[1] > time.monotonic():
+            return entry[0]
+        del group[user_id]
+        self._entries -= 1
+        if not group:
+            del self._cache[group_id]
+            self._warmed_at.pop(group_id, None)
+        return None
+
+    def _store(self, group_id: str, names: dict, prune: bool = False):
+        now = time.monotonic()
+        group = self._cache.get(group_id)
+        if group is None:
+            group = self._cache[group_id] = {}
+        elif prune:
+            # 预热整个群时顺带清掉该群已过期的条目
+            expired = [uid for uid, entry in group.items() if entry[1] <= now]
+            for uid in expired:
+                del group[uid]
+            self._entries -= len(expired)
+        before = len(group)
+        expires_at = now + self.ttl
+        group.update((uid, (name, expires_at)) for uid, name in names.items())
+        self._entries += len(group) - before
+        self._cache.move_to_end(group_id)
+        # 至少保留刚写入的群，单个大群超出上限时也不会被立即淘汰
+        while self._entries > self.max_entries and len(self._cache) > 1:
+            evicted_id, evicted = self._cache.popitem(last=False)
+            self._entries -= len(evicted)
+            self._warmed_at.pop(evicted_id, None)
+            self.evictions += 1
+
+    async def _resolve_one(self, event, group_id: str, user_id: str):
+        key = (group_id, user_id)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_one(event, group_id, user_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        await asyncio.shield(task)
+
+    async def _fetch_one(self, event, group_id: str, user_id: str):
+        self.api_calls += 1
+        name = await self._fetch_member(event, user_id)
+        if name:
+            self._store(group_id, {user_id: name})
+
+    async def _warm_group(self, event, group_id: str):
+        warmed_at = self._warmed_at.get(group_id)
+        if warmed_at is not None and time.monotonic() - warmed_at < self.ttl:
+            return
+        task = self._warm_inflight.get(group_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_group(event, group_id))
+            self._warm_inflight[group_id] = task
+            task.add_done_callback(lambda _: self._warm_inflight.pop(group_id, None))
+        await asyncio.shield(task)
+
+    async def _fetch_group(self, event, group_id: str):
+        self.api_calls += 1
+        members = await self._fetch_member_list(event)
+        if not members:
+            return
+        self._store(
+            group_id,
+            {str(user_id): name for user_id, name in members.items()},
+            prune=True,
+        )
+        self._warmed_at[group_id] = time.monotonic()
@@ -0,0 +1,66 @@
+from bisect import bisect_left, insort
+
+
+class RankIndex:
+    """按分数降序维护的有序索引。
+
+    内部是按 (-分数, 用户ID) 排序的列表，更新与名次查询都通过二分查找定位，
+    取前 K 名只需切片，不必每次对全群重新排序。
+    """
+
+    # 一次变化超过这么多用户时改为整体归并
+    BATCH_THRESHOLD = 32
+
+    def __init__(self, items=None):
+        self._keys = []
+        self._scores = {}
+        if items:
+            self._scores = dict(items)
+            self._keys = sorted((-score, uid) for uid, score in self._scores.items())
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def score(self, user_id):
+        return self._scores.get(user_id)
+
+    def update(self, user_id: str, score: float) -> bool:
+        old = self._scores.get(user_id)
+        if old == score:
+            return False
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+        insort(self._keys, (-score, user_id))
+        self._scores[user_id] = score
+        return True
+
+    def update_many(self, items) -> int:
+        """批量更新分数，返回实际变化的用户数。
+
+        变化的用户较多时不逐个二分插入（每次都要搬移整个列表），而是去掉旧键后
+        把新键排好序追加在末尾，再整体排序一次；两段都已有序，排序只是线性归并。
+        """
+        changed = {
+            user_id: score
+            for user_id, score in items
+            if self._scores.get(user_id) != score
+        }
+        if len(changed) <= self.BATCH_THRESHOLD:
+            for user_id, score in changed.items():
+                self.update(user_id, score)
+            return len(changed)
+        keys = [key for key in self._keys if key[1] not in changed]
+        keys.extend(sorted((-score, user_id) for user_id, score in changed.items()))
+        keys.sort()
+        self._keys = keys
+        self._scores.update(changed)
+        return len(changed)
+
+    def top(self, k: int) -> list:
+        return [(user_id, -neg_score) for neg_score, user_id in self._keys[:k]]
+
+    def rank(self, user_id: str):
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self._keys, (-score, user_id)) + 1
@@ -0,0 +1,300 @@
+import asyncio
+import io
+import itertools
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from urllib.parse import quote
+
+import aiofiles
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from astrbot.api import logger
+
+# 与 card_template.html 的布局保持一致
+CARD_SIZE = (1280, 720)
+AVATAR_BOX = (60, 200, 166)
+AVATAR_SIZE = 160
+PANEL_MARGIN = 20
+PANEL_GAP = 20
+MIDDLE_PANEL_HEIGHT = 120
+BOTTOM_PANEL_HEIGHT = 150
+PANEL_RADIUS = 20
+PANEL_FILL = (255, 255, 255, 178)
+# 输出文件在卡片缓存过期后再多保留的秒数，留给平台上传刚返回的图片
+OUTPUT_GRACE = 60.0
+
+
+@lru_cache(maxsize=16)
+def _font(font_path: str, size: int):
+    # 每个工作进程各自缓存字体对象
+    if font_path and os.path.exists(font_path):
+        return ImageFont.truetype(font_path, size)
+    return ImageFont.load_default(size)
+
+
+def _open_image(data: bytes):
+    if not data:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image.convert("RGBA")
+    except Exception:
+        return None
+
+
+def _circle(image, size: int):
+    image = ImageOps.fit(image, (size, size))
+    mask = Image.new("L", (size, size), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, size - 1, size - 1), fill=255)
+    image.putalpha(mask)
+    return image
+
+
+def _text(draw, xy, text, font, fill, anchor="la", shadow=False):
+    if shadow:
+        draw.text(
+            (xy[0] + 1, xy[1] + 1), text, font=font, fill=(0, 0, 0), anchor=anchor
+        )
+    draw.text(xy, text, font=font, fill=fill, anchor=anchor)
+
+
+def render_card_image(
+    render_data: dict, font_path: str, bg_bytes: bytes, avatar_bytes: bytes
+) -> bytes:
+    """按卡片模板的布局用 Pillow 绘制签到卡片，返回 JPEG 字节。
+
+    在进程池中执行，参数和返回值都只使用可序列化的基本类型。
+    """
+    width, height = CARD_SIZE
+    background = _open_image(bg_bytes)
+    if background is not None:
+        card = ImageOps.fit(background, CARD_SIZE)
+    else:
+        card = Image.new("RGBA", CARD_SIZE, (230, 230, 230, 255))
+
+    overlay = Image.new("RGBA", CARD_SIZE, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    font = partial(_font, font_path)
+
+    # 用户信息区
+    box_x, box_y, box_size = AVATAR_BOX
+    draw.ellipse(
+        (box_x, box_y, box_x + box_size, box_y + box_size),
+        fill=(255, 255, 255, 128),
+    )
+    center_y = box_y + box_size // 2
+    info_x = box_x + box_size + 20
+    _text(
+        draw,
+        (info_x, center_y - 40),
+        f"QQ: {render_data['user_id']}",
+        font(28),
+        (0, 0, 0),
+        "ls",
+        shadow=True,
+    )
+    _text(
+        draw,
+        (info_x, center_y + 8),
+        str(render_data["user_name"]),
+        font(36),
+        (255, 165, 0),
+        "ls",
+        shadow=True,
+    )
+    _text(
+        draw,
+        (info_x, center_y + 48),
+        f"身份: {render_data['status']} | 等级: {render_data['wealth_level']}",
+        font(28),
+        (51, 51, 51),
+        "ls",
+        shadow=True,
+    )
+
+    # 中部面板：时间 + 收益
+    bottom_top = height - PANEL_MARGIN - BOTTOM_PANEL_HEIGHT
+    middle_top = bottom_top - PANEL_GAP - MIDDLE_PANEL_HEIGHT
+    half = (width - 2 * PANEL_MARGIN - PANEL_GAP) // 2
+    time_box = (PANEL_MARGIN, middle_top, PANEL_MARGIN + half, bottom_top - PANEL_GAP)
+    income_box = (
+        time_box[2] + PANEL_GAP,
+        middle_top,
+        width - PANEL_MARGIN,
+        time_box[3],
+    )
+    bottom_box = (PANEL_MARGIN, bottom_top, width - PANEL_MARGIN, height - PANEL_MARGIN)
+    for box in (time_box, income_box, bottom_box):
+        draw.rounded_rectangle(box, radius=PANEL_RADIUS, fill=PANEL_FILL)
+
+    _text(
+        draw,
+        (time_box[0] + 20, time_box[1] + 20),
+        render_data["time_title"],
+        font(28),
+        (51, 51, 51),
+    )
+    _text(
+        draw,
+        (time_box[0] + 20, time_box[1] + 66),
+        render_data["current_time"],
+        font(28),
+        (51, 51, 51),
+    )
+
+    income_x = (income_box[0] + income_box[2]) // 2
+    income_y = (income_box[1] + income_box[3]) // 2
+    if render_data.get("is_query"):
+        total = f"{render_data['total_income']:.1f} 金币"
+        detail = (
+            f"基础{render_data['base_with_bonus']:.1f} + "
+            f"契约{render_data['contract_bonus']:.1f} + "
+            f"连签{render_data['consecutive_bonus']:.1f} + "
+            f"利息{render_data['tomorrow_interest']:.1f}"
+        )
+        _text(
+            draw,
+            (income_x, income_y - 30),
+            render_data["income_title"],
+            font(28),
+            (51, 51, 51),
+            "mm",
+        )
+        _text(draw, (income_x, income_y + 6), total, font(32), (255, 69, 0), "mm")
+        _text(draw, (income_x, income_y + 40), detail, font(22), (51, 51, 51), "mm")
+    else:
+        total = f"{render_data['earned']:.1f} (含利息{render_data['interest']:.1f})"
+        _text(
+            draw,
+            (income_x, income_y - 20),
+            render_data["income_title"],
+            font(28),
+            (51, 51, 51),
+            "mm",
+        )
+        _text(draw, (income_x, income_y + 20), total, font(32), (255, 69, 0), "mm")
+
+    # 底部面板：四项指标均分
+    metrics = (
+        ("现金", f"{render_data['coins']:.1f}"),
+        ("银行", f"{render_data['bank']:.1f}"),
+        ("雇员", str(render_data["contractors_display"])),
+        ("连续签到", str(render_data["consecutive"])),
+    )
+    slot = (bottom_box[2] - bottom_box[0]) / len(metrics)
+    metric_y = (bottom_box[1] + bottom_box[3]) // 2
+    for index, (title, value) in enumerate(metrics):
+        x = int(bottom_box[0] + slot * (index + 0.5))
+        _text(draw, (x, metric_y - 22), title, font(28), (51, 51, 51), "mm")
+        _text(draw, (x, metric_y + 26), value, font(28), (0, 0, 0), "mm")
+
+    card = Image.alpha_composite(card.convert("RGBA"), overlay)
+    avatar = _open_image(avatar_bytes)
+    if avatar is not None:
+        offset = (box_size - AVATAR_SIZE) // 2
+        avatar = _circle(avatar, AVATAR_SIZE)
+        card.alpha_composite(avatar, (box_x + offset, box_y + offset))
+
+    output = io.BytesIO()
+    card.convert("RGB").save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class LocalRenderer:
+    """在进程池中用 Pillow 绘制卡片，不依赖外部的 HTML 渲染服务。
+
+    输出写入本地文件并返回文件路径。每次渲染使用独立的临时文件和输出文件名，
+    并发渲染同一张卡片互不干扰，已返回的路径在平台上传前也不会被覆盖。
+    卡片缓存会在有效期内重复返回同一个路径，因此输出文件按写入时间保留
+    keep_seconds 秒（应不短于卡片缓存的有效期），过期后在新渲染完成时删除；
+    启动时清理上次运行留下的文件。
+    """
+
+    def __init__(
+        self,
+        font_path: str,
+        output_dir: str,
+        workers: int = 2,
+        keep_seconds: float = 60.0 + OUTPUT_GRACE,
+    ):
+        self.font_path = font_path
+        self.output_dir = output_dir
+        self.workers = max(1, workers)
+        self.keep_seconds = keep_seconds
+        os.makedirs(output_dir, exist_ok=True)
+        self._executor = None
+        self._serial = itertools.count()
+        self._outputs = deque()
+        self._remove_stale_outputs()
+
+        self.rendered = 0
+        self.failures = 0
+
+    @property
+    def stats(self) -> dict:
+        return {"rendered": self.rendered, "failures": self.failures}
+
+    async def render(
+        self, card_name: str, render_data: dict, bg_bytes: bytes, avatar_bytes: bytes
+    ) -> str:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        try:
+            image_bytes = await loop.run_in_executor(
+                self._executor,
+                render_card_image,
+                render_data,
+                self.font_path,
+                bg_bytes,
+                avatar_bytes,
+            )
+            path = await self._write_output(card_name, image_bytes)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"本地渲染卡片失败: {e}")
+            return ""
+        self.rendered += 1
+        return os.path.abspath(path)
+
+    async def _write_output(self, card_name: str, image_bytes: bytes) -> str:
+        name = quote(card_name, safe="")
+        path = os.path.join(self.output_dir, f"{name}.{next(self._serial)}.jpg")
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f"{name}.", suffix=".tmp", dir=self.output_dir
+        )
+        os.close(fd)
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                await f.write(image_bytes)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove_quietly(tmp_path)
+            raise
+        now = time.monotonic()
+        self._outputs.append((now + self.keep_seconds, path))
+        while self._outputs[0][0] <= now:
+            _remove_quietly(self._outputs.popleft()[1])
+        return path
+
+    def _remove_stale_outputs(self):
+        for entry in os.scandir(self.output_dir):
+            if entry.is_file() and entry.name.endswith((".jpg", ".tmp")):
+                _remove_quietly(entry.path)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from collections import deque
+
+
+class RenderOverloaded(Exception):
+    """渲染繁忙，异常信息是代替图片发给用户的纯文字回复。"""
+
+
+class RenderScheduler:
+    """限制同时进行的卡片渲染数量。
+
+    超出并发上限的请求在有界队列中等待空闲名额；队列已满或等待超时时
+    立即拒绝，由调用方改为纯文字回复。
+    """
+
+    def __init__(
+        self, concurrency: int = 4, queue_limit: int = 50, max_wait: float = 20.0
+    ):
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = max(0, queue_limit)
+        self.max_wait = max_wait
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._waits = deque(maxlen=500)
+
+        self.waiting = 0
+        self.running = 0
+        self.max_depth = 0
+        self.completed = 0
+        self.dropped = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_depth": self.max_depth,
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "wait_p50_ms": self._wait_percentile(0.5),
+            "wait_p95_ms": self._wait_percentile(0.95),
+        }
+
+    async def run(self, factory):
+        if self.running + self.waiting >= self.concurrency + self.queue_limit:
+            self.dropped += 1
+            raise RenderOverloaded()
+
+        self.waiting += 1
+        self.max_depth = max(self.max_depth, self.waiting)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            raise RenderOverloaded() from None
+        finally:
+            self.waiting -= 1
+        self._waits.append(time.monotonic() - started)
+
+        self.running += 1
+        try:
+            return await factory()
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def _wait_percentile(self, percentile: float):
+        if not self._waits:
+            return None
+        ordered = sorted(self._waits)
+        index = min(len(ordered) - 1, int(percentile * len(ordered)))
+        return round(ordered[index] * 1000, 1)
@@ -0,0 +1,96 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def settle(
+    groups: dict,
+    purchase_data: dict,
+    levels: list,
+    rate_bonus: float,
+    interest_rate: float = 0.01,
+) -> dict:
+    """对所有用户做一次日结：发放银行利息，并计算每人的雇员加成总和。
+
+    groups 为 {群号: {用户ID: UserRecord}}，利息直接写回记录；
+    返回 {群号: {用户ID: 雇员加成}}，只包含有雇员的用户。
+    安装了 NumPy 时雇员加成按列批量计算，否则退回逐个用户的循环。
+    """
+    # 用户记录是带 __slots__ 的对象，逐个原地更新比先取成一列再写回更快
+    for group_data in groups.values():
+        for record in group_data.values():
+            record.bank += record.bank * interest_rate
+
+    owners = [
+        (group_id, uid, record)
+        for group_id, group_data in groups.items()
+        for uid, record in group_data.items()
+        if record.contractors
+    ]
+    if not owners:
+        return {}
+    if np is None:
+        totals = _contractor_rates_python(
+            owners, groups, purchase_data, levels, rate_bonus
+        )
+    else:
+        totals = _contractor_rates_numpy(
+            owners, groups, purchase_data, levels, rate_bonus
+        )
+
+    result = {}
+    for (group_id, uid, _), total in zip(owners, totals):
+        result.setdefault(group_id, {})[uid] = total
+    return result
+
+
+def _contractor_rates_numpy(owners, groups, purchase_data, levels, rate_bonus) -> list:
+    # 把全部雇佣关系展开成列，身价分档用 searchsorted，按雇主求和用 bincount
+    edge_owners = []
+    contractors = []
+    contractor_ids = []
+    for ordinal, (group_id, _, record) in enumerate(owners):
+        group_data = groups[group_id]
+        edge_owners.extend([ordinal] * len(record.contractors))
+        contractor_ids.extend(record.contractors)
+        contractors.extend(group_data.get(cid) for cid in record.contractors)
+
+    edges = len(contractor_ids)
+    wealth = np.fromiter(map(_wealth, contractors), dtype=np.float64, count=edges)
+    bought = np.fromiter(
+        (purchase_data.get(cid, 0) for cid in contractor_ids),
+        dtype=np.float64,
+        count=edges,
+    )
+    thresholds = np.array([level[0] for level in levels], dtype=np.float64)
+    tier_rates = np.array([level[2] for level in levels], dtype=np.float64)
+    tiers = np.clip(np.searchsorted(thresholds, wealth, side="right") - 1, 0, None)
+    return np.bincount(
+        np.array(edge_owners, dtype=np.int64),
+        weights=tier_rates[tiers] + bought * rate_bonus,
+        minlength=len(owners),
+    ).tolist()
+
+
+def _contractor_rates_python(owners, groups, purchase_data, levels, rate_bonus) -> list:
+    def base_rate(record) -> float:
+        total = _wealth(record)
+        for min_coin, _, rate in reversed(levels):
+            if total >= min_coin:
+                return rate
+        return levels[0][2]
+
+    return [
+        sum(
+            base_rate(groups[group_id].get(cid))
+            + purchase_data.get(cid, 0) * rate_bonus
+            for cid in record.contractors
+        )
+        for group_id, _, record in owners
+    ]
+
+
+def _wealth(record) -> float:
+    # 雇员不在群数据中时按零身价处理，与逐个计算时新建空记录一致
+    return record.coins + record.bank if record is not None else 0.0
@@ -0,0 +1,1007 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+import aiofiles
+import yaml
+
+from astrbot.api import logger
+
+from .models import UserRecord, records_from_dict
+
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 优先使用 libyaml 提供的 C 实现，缺失时回退到纯 Python 实现
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+SNAPSHOT_EXTENSIONS = {"yaml": ".yml", "json": ".json", "msgpack": ".msgpack"}
+# 快照头：魔数、代数、正文长度、正文 CRC32
+CHECKPOINT_MAGIC = b"QSNAP1"
+
+
+class CheckpointError(Exception):
+    """快照文件存在，但没有任何一代能通过校验。"""
+
+
+def snapshot_path_for(path: str, fmt: str) -> str:
+    return os.path.splitext(path)[0] + SNAPSHOT_EXTENSIONS.get(fmt, ".yml")
+
+
+def resolve_snapshot_format(fmt: str) -> str:
+    if fmt == "msgpack" and msgpack is None:
+        logger.warning("未安装 msgpack，快照格式回退为 json。")
+        return "json"
+    return fmt if fmt in SNAPSHOT_EXTENSIONS else "yaml"
+
+
+def serialize_snapshot(data: dict, fmt: str) -> bytes:
+    if fmt == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    if fmt == "json":
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+    return yaml.dump(data, Dumper=YamlDumper, allow_unicode=True).encode("utf-8")
+
+
+def deserialize_snapshot(raw: bytes) -> dict:
+    if not raw.strip():
+        return {}
+    first = raw[0]
+    if 0x80 <= first <= 0x8F or first in (0xDE, 0xDF):
+        if msgpack is None:
+            raise RuntimeError("快照为 msgpack 格式，但未安装 msgpack")
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False) or {}
+    if raw.lstrip()[:1] == b"{":
+        try:
+            return json.loads(raw) or {}
+        except ValueError:
+            pass
+    return yaml.load(raw, Loader=YamlLoader) or {}
+
+
+def encode_checkpoint(data: dict, fmt: str, generation: int) -> bytes:
+    payload = serialize_snapshot(data, fmt)
+    header = b"%s %d %d %08x\n" % (
+        CHECKPOINT_MAGIC,
+        generation,
+        len(payload),
+        zlib.crc32(payload),
+    )
+    return header + payload
+
+
+def decode_checkpoint(raw: bytes) -> tuple:
+    """校验并解析快照，返回 (数据, 代数)。没有快照头的旧文件视为第 0 代。"""
+    if not raw.strip():
+        # 崩溃后可能留下长度为零的文件，旧版保存空数据也不会写出空文件
+        raise ValueError("快照文件为空")
+    if raw.startswith(CHECKPOINT_MAGIC):
+        header, _, payload = raw.partition(b"\n")
+        _, generation, length, checksum = header.split()
+        if len(payload) != int(length):
+            raise ValueError(f"快照长度不符（{len(payload)}/{int(length)} 字节）")
+        if zlib.crc32(payload) != int(checksum, 16):
+            raise ValueError("快照校验和不符")
+        generation = int(generation)
+    else:
+        payload, generation = raw, 0
+    data = deserialize_snapshot(payload)
+    if not isinstance(data, dict):
+        raise ValueError("快照内容不是映射")
+    return data, generation
+
+
+def load_checkpoint(path: str) -> tuple:
+    """读取最新一代能通过校验的快照，返回 (数据, 代数, 跳过的损坏文件列表)。
+
+    当前格式的最新快照完好时不会列目录；没有任何快照文件时返回空数据；
+    有文件但全部损坏时抛出 CheckpointError，而不是当作空数据继续运行。
+    """
+    variants = [snapshot_path_for(path, fmt) for fmt in SNAPSHOT_EXTENSIONS]
+    current = sorted(
+        (variant for variant in variants if os.path.exists(variant)),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    skipped = []
+    if current and current[0] == path:
+        loaded = _read_checkpoint(path)
+        if loaded is not None:
+            return (*loaded, [])
+        skipped.append(path)
+        current = current[1:]
+    # 当前格式的快照缺失（轮换中途中断）、损坏或比其他格式的旧时，
+    # 列出保留的历代快照，连同其他格式的快照一起按代数从新到旧尝试；
+    # 其他格式的快照可能是切换格式前留下的旧文件，不能只看修改时间
+    fallbacks = [item for variant in variants for item in _numbered_files(variant)] + [
+        (_peek_generation(candidate), candidate) for candidate in current
+    ]
+    for _, candidate in sorted(fallbacks, reverse=True):
+        loaded = _read_checkpoint(candidate)
+        if loaded is not None:
+            return (*loaded, skipped)
+        skipped.append(candidate)
+    if skipped:
+        raise CheckpointError(f"{path} 的 {len(skipped)} 个快照文件均无法通过校验")
+    return {}, 0, []
+
+
+def _peek_generation(path: str) -> int:
+    try:
+        with open(path, "rb") as f:
+            header = f.readline(128).split()
+        if header[:1] == [CHECKPOINT_MAGIC]:
+            return int(header[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return 0
+
+
+def _read_checkpoint(path: str):
+    try:
+        with open(path, "rb") as f:
+            return decode_checkpoint(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"快照文件无法使用 ({path}): {e}")
+        return None
+
+
+_file_locks = {}
+
+
+async def save_checkpoint(
+    data: dict,
+    file_path: str,
+    fmt: str,
+    generation: int,
+    keep: int = 3,
+    quarantine: list = (),
+):
+    """原子写入第 generation 代快照，并保留最近 keep 代。
+
+    先写临时文件并 fsync，再把当前快照改名为 <快照>.<上一代>，最后换上新文件；
+    任何一步中断，目录里都至少有一代完整的快照。写入失败时抛出异常。
+    quarantine 中是加载时未通过校验的文件，改名为 .corrupt 留作排查，不参与轮换。
+    """
+    lock = _file_locks.setdefault(file_path, asyncio.Lock())
+    async with lock:
+        content = await asyncio.to_thread(encode_checkpoint, data, fmt, generation)
+        await asyncio.to_thread(
+            _replace_checkpoint, content, file_path, generation, keep, quarantine
+        )
+
+
+def _replace_checkpoint(
+    content: bytes, file_path: str, generation: int, keep: int, quarantine: list = ()
+):
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    for path in quarantine:
+        if path != file_path:
+            _quarantine(path)
+    if file_path in quarantine:
+        # 保留原文件直到新快照换上，中途中断时下次加载仍会按损坏处理并回退
+        _quarantine(file_path, keep_original=True)
+    elif keep > 1 and os.path.exists(file_path):
+        # 按文件自身的代数归档；切换格式后留下的旧快照不会冒充上一代
+        os.replace(file_path, f"{file_path}.{_peek_generation(file_path)}")
+    os.replace(tmp_path, file_path)
+    _fsync_dir(os.path.dirname(file_path))
+    # 按实际存在的文件保留最近 keep - 1 代；回退恢复后代数会跳跃，
+    # 按代数推算会误删仍然完好的旧快照
+    for _, old in _numbered_files(file_path)[max(0, keep - 1) :]:
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass
+
+
+def _quarantine(path: str, keep_original: bool = False):
+    corrupt_path = f"{path}.corrupt"
+    try:
+        os.remove(corrupt_path)
+    except FileNotFoundError:
+        pass
+    try:
+        if not keep_original:
+            os.replace(path, corrupt_path)
+            return
+        try:
+            os.link(path, corrupt_path)
+        except OSError:
+            # 文件系统不支持硬链接时退回复制
+            shutil.copyfile(path, corrupt_path)
+    except FileNotFoundError:
+        pass
+
+
+def _numbered_files(path: str) -> list:
+    """列出 <path>.<数字> 形式的文件，按数字从大到小排序。"""
+    directory, base = os.path.split(path)
+    pattern = re.compile(re.escape(base) + r"\.(\d+)$")
+    try:
+        names = os.listdir(directory or ".")
+    except FileNotFoundError:
+        return []
+    found = [
+        (int(match.group(1)), os.path.join(directory, name))
+        for match, name in ((pattern.match(name), name) for name in names)
+        if match
+    ]
+    return sorted(found, reverse=True)
+
+
+def _fsync_dir(directory: str):
+    # 确保改名本身已经落盘；部分平台不支持对目录 fsync
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class WriteBehind:
+    """合并写入调度器。
+
+    变更只把对应的用户标记为脏，在一个写入窗口内最多落盘一次，
+    同一时刻只有一个刷新在进行；写入失败的记录会重新标记，等待下次刷新。
+    """
+
+    def __init__(
+        self,
+        store,
+        resolve_user,
+        resolve_purchase,
+        window: float = 1.0,
+        metrics=None,
+    ):
+        self.store = store
+        self.window = window
+        self._metrics = metrics
+        self._resolve_user = resolve_user
+        self._resolve_purchase = resolve_purchase
+        self._dirty_users = {}
+        self._dirty_purchases = set()
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+
+        self.saves_requested = 0
+        self.flushes_performed = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "saves_requested": self.saves_requested,
+            "flushes_performed": self.flushes_performed,
+            "pending_users": sum(len(ids) for ids in self._dirty_users.values()),
+        }
+
+    def has_pending(self, group_id: str) -> bool:
+        return bool(self._dirty_users.get(str(group_id)))
+
+    def mark_users(self, group_id: str, user_ids):
+        self._dirty_users.setdefault(str(group_id), set()).update(
+            str(uid) for uid in user_ids if uid
+        )
+        self.saves_requested += 1
+        self._schedule()
+
+    def mark_purchase(self, user_id: str):
+        self._dirty_purchases.add(str(user_id))
+        self.saves_requested += 1
+        self._schedule()
+
+    async def flush(self):
+        async with self._flush_lock:
+            dirty_users, self._dirty_users = self._dirty_users, {}
+            dirty_purchases, self._dirty_purchases = self._dirty_purchases, set()
+            if not dirty_users and not dirty_purchases:
+                return
+            users = {}
+            for group_id, user_ids in dirty_users.items():
+                for user_id in user_ids:
+                    record = self._resolve_user(group_id, user_id)
+                    if record is not None:
+                        users.setdefault(group_id, {})[user_id] = record
+            purchases = {uid: self._resolve_purchase(uid) for uid in dirty_purchases}
+            started = time.perf_counter()
+            try:
+                await self.store.save_batch(users, purchases)
+            except Exception as e:
+                if self._metrics is not None:
+                    self._metrics.error("stage.save_batch")
+                logger.error(f"签到数据落盘失败，将在下次刷新时重试: {e}")
+                for group_id, user_ids in dirty_users.items():
+                    self._dirty_users.setdefault(group_id, set()).update(user_ids)
+                self._dirty_purchases.update(dirty_purchases)
+                self._schedule()
+                return
+            if self._metrics is not None:
+                self._metrics.observe("stage.save_batch", time.perf_counter() - started)
+            self.flushes_performed += 1
+
+    async def close(self):
+        if self._timer and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
+        await self.store.close()
+
+    def _schedule(self):
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        await asyncio.shield(self.flush())
+
+
+async def load_legacy_data(
+    snapshot_path: str, purchase_path: str, journal_path: str
+) -> tuple:
+    """读取旧版单文件布局（sign_data.yml + purchase_counts.yml + 日志）。"""
+    snapshot, _, _ = await asyncio.to_thread(load_checkpoint, snapshot_path)
+    sign_data = await asyncio.to_thread(records_from_dict, snapshot)
+    purchase_data, _, _ = await asyncio.to_thread(load_checkpoint, purchase_path)
+    for path in (journal_path + ".old", journal_path):
+        content = await _read_text(path)
+        if content:
+            await asyncio.to_thread(
+                _apply_legacy_journal, content, path, sign_data, purchase_data
+            )
+    return sign_data, purchase_data
+
+
+def _apply_legacy_journal(
+    content: str, path: str, sign_data: dict, purchase_data: dict
+):
+    for entry in _parse_journal(content, path):
+        if "p" in entry:
+            purchase_data[entry["p"]] = entry["n"]
+        else:
+            sign_data.setdefault(entry["g"], {})[entry["u"]] = UserRecord.from_dict(
+                entry["d"]
+            )
+
+
+def _parse_journal(content: str, path: str):
+    for line_no, line in enumerate(content.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"跳过损坏的签到日志记录 ({path}:{line_no})")
+
+
+async def _read_text(path: str) -> str:
+    try:
+        async with aiofiles.open(path, "r", encoding="utf-8") as f:
+            return await f.read()
+    except FileNotFoundError:
+        return ""
+    except Exception as e:
+        logger.error(f"读取签到日志失败 ({path}): {e}")
+        return ""
+
+
+class JournalShard:
+    """单个数据分片：快照 + 追加日志。
+
+    每次变更只向日志追加一行被修改条目的完整值，写入代价与分片大小无关；
+    合并时把日志折叠进快照（YAML/JSON/msgpack）。
+    快照带代数和校验和，保留最近 keep 代，合并过的日志按代归档；
+    最新快照损坏时回退到上一代并重放其后的归档日志，数据不会丢失。
+    """
+
+    def __init__(
+        self,
+        snapshot_path: str,
+        journal_path: str,
+        snapshot_format: str,
+        decode,
+        encode,
+        keep: int = 3,
+    ):
+        self.snapshot_format = snapshot_format
+        self.snapshot_path = snapshot_path_for(snapshot_path, snapshot_format)
+        self.journal_path = journal_path
+        self.rotated_path = journal_path + ".old"
+        self.keep = max(1, keep)
+        self._decode = decode
+        self._encode = encode
+
+        self.data = {}
+        self.pending_entries = 0
+        self.generation = 0
+        self.loaded = False
+        self.recovery = None
+        self._corrupt = []
+
+        self._journal = None
+        self._write_lock = asyncio.Lock()
+        self._compact_lock = asyncio.Lock()
+
+    async def load(self) -> dict:
+        started = time.perf_counter()
+        snapshot, self.generation, corrupt = await asyncio.to_thread(
+            load_checkpoint, self.snapshot_path
+        )
+        skipped = len(corrupt)
+        self.data = await asyncio.to_thread(self._decode_all, snapshot)
+        journals = [self.rotated_path, self.journal_path]
+        if skipped:
+            # 回退到较早的一代时，先重放这一代之后归档的日志
+            journals[:0] = [
+                path
+                for generation, path in reversed(_numbered_files(self.journal_path))
+                if generation > self.generation
+            ]
+        replayed = 0
+        for path in journals:
+            content = await _read_text(path)
+            if content:
+                # 分片尚未对外可见，可以直接在工作线程中解析并应用
+                replayed += await asyncio.to_thread(self._apply_journal, content, path)
+        self.pending_entries += replayed
+        self.recovery = {
+            "generation": self.generation,
+            "skipped": skipped,
+            "replayed": replayed,
+            "seconds": time.perf_counter() - started,
+        }
+        if skipped:
+            logger.warning(
+                f"{self.snapshot_path} 的最新快照损坏，已回退到第 {self.generation} 代"
+                f"并重放 {replayed} 条日志，耗时 {self.recovery['seconds'] * 1000:.0f}ms。"
+            )
+            # 尽快写出一代完好的快照，损坏的文件届时隔离而不参与轮换；
+            # 代数越过所有已有文件，新的归档日志不会覆盖回退时重放过的日志
+            self._corrupt = corrupt
+            self.pending_entries = max(self.pending_entries, 1)
+            self.generation = (
+                max(
+                    self.generation,
+                    *(number for number, _ in _numbered_files(self.snapshot_path)),
+                    *(number for number, _ in _numbered_files(self.journal_path)),
+                )
+                + 1
+            )
+        self.loaded = True
+        return self.data
+
+    async def append(self, items: dict):
+        if not self.loaded:
+            raise CheckpointError(f"{self.snapshot_path} 尚未成功加载，拒绝写入")
+        self.data.update(items)
+        lines = "".join(
+            json.dumps(
+                {"k": key, "v": self._encode(value)},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            + "\n"
+            for key, value in items.items()
+        )
+        async with self._write_lock:
+            if self._journal is None:
+                self._journal = await aiofiles.open(
+                    self.journal_path, "a", encoding="utf-8"
+                )
+            await self._journal.write(lines)
+            await self._journal.flush()
+            self.pending_entries += len(items)
+
+    async def compact(self):
+        # 未成功加载的分片只有部分数据，绝不能写成新快照覆盖磁盘上的数据
+        if not self.loaded:
+            return
+        async with self._compact_lock:
+            async with self._write_lock:
+                if self.pending_entries == 0 and not os.path.exists(self.rotated_path):
+                    return
+                await self._rotate_journal()
+            # 轮转之后生成的快照必然包含 .old 中的全部记录，
+            # 之后新日志中的记录重放时是幂等的覆盖写。
+            snapshot = {key: self._encode(value) for key, value in self.data.items()}
+            generation = self.generation + 1
+            await save_checkpoint(
+                snapshot,
+                self.snapshot_path,
+                self.snapshot_format,
+                generation,
+                self.keep,
+                quarantine=self._corrupt,
+            )
+            self._corrupt = []
+            self.generation = generation
+            await asyncio.to_thread(self._archive_journal, generation)
+
+    async def close(self):
+        await self.compact()
+        async with self._write_lock:
+            if self._journal:
+                await self._journal.close()
+                self._journal = None
+
+    def _archive_journal(self, generation: int):
+        # .old 中是从上一代到这一代的变更，归档后可以从保留的任一代快照重放到最新
+        if self.keep > 1 and os.path.exists(self.rotated_path):
+            os.replace(self.rotated_path, f"{self.journal_path}.{generation}")
+        else:
+            try:
+                os.remove(self.rotated_path)
+            except FileNotFoundError:
+                pass
+        # 最早保留的一代快照之前的归档日志不再需要
+        snapshots = _numbered_files(self.snapshot_path)
+        oldest = snapshots[-1][0] if snapshots else generation
+        for number, old in _numbered_files(self.journal_path):
+            if number <= oldest:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+
+    def _decode_all(self, snapshot: dict) -> dict:
+        return {
+            sys.intern(str(key)): self._decode(value) for key, value in snapshot.items()
+        }
+
+    def _apply_journal(self, content: str, path: str) -> int:
+        count = 0
+        for entry in _parse_journal(content, path):
+            self.data[sys.intern(str(entry["k"]))] = self._decode(entry["v"])
+            count += 1
+        return count
+
+    async def _rotate_journal(self):
+        if self._journal:
+            await self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            if os.path.exists(self.rotated_path):
+                # 上一次合并未完成，把当前日志接到旧日志后面
+                content = await _read_text(self.journal_path)
+                async with aiofiles.open(
+                    self.rotated_path, "a", encoding="utf-8"
+                ) as dst:
+                    await dst.write(content)
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+        self.pending_entries = 0
+
+
+class ShardedStore:
+    """按群分片的文件存储后端。
+
+    每个群一个分片（快照 + 日志），首次访问时才加载，空闲时可以整体卸载；
+    购买次数是全局数据，单独存为一个常驻分片。
+    后台任务按时间间隔或日志条数阈值合并各分片的日志，
+    因此加载一个分片最多重放 keep 个日志文件，恢复时间有上限。
+    """
+
+    PURCHASE_SHARD = "_purchase_counts"
+    MIGRATED_MARKER = ".migrated"
+
+    def __init__(
+        self,
+        shard_dir: str,
+        compact_interval: float = 300.0,
+        compact_threshold: int = 2000,
+        snapshot_format: str = "yaml",
+        legacy_paths: tuple = (),
+        keep_generations: int = 3,
+    ):
+        self.shard_dir = shard_dir
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+        self.snapshot_format = resolve_snapshot_format(snapshot_format)
+        self.legacy_paths = legacy_paths
+        self.keep_generations = max(1, keep_generations)
+
+        self._shards = {}
+        self._closing = {}
+        self._purchases = None
+        self._compact_event = asyncio.Event()
+        self._compact_task = None
+        self._stopping = False
+
+        self.shard_loads = 0
+        self.recoveries = 0
+        self.recovery_max = 0.0
+        self.recovery_total = 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "loaded_groups": len(self._shards),
+            "shard_loads": self.shard_loads,
+            "fallback_recoveries": self.recoveries,
+            "load_max_ms": round(self.recovery_max * 1000, 1),
+            "load_avg_ms": round(self.recovery_total * 1000 / self.shard_loads, 1)
+            if self.shard_loads
+            else None,
+        }
+
+    async def load(self) -> tuple:
+        os.makedirs(self.shard_dir, exist_ok=True)
+        await self._migrate_legacy()
+        self._purchases = self._purchase_shard()
+        await self._purchases.load()
+        self._record_recovery(self._purchases)
+        self._compact_task = asyncio.create_task(self._compact_loop())
+        return {}, self._purchases.data
+
+    async def load_group(self, group_id: str) -> dict:
+        group_id = str(group_id)
+        closing = self._closing.get(group_id)
+        if closing is not None:
+            await closing
+        shard = self._shards.get(group_id)
+        if shard is None:
+            shard = self._group_shard(group_id)
+            await shard.load()
+            self._record_recovery(shard)
+            self._shards[group_id] = shard
+            if shard.pending_entries >= self.compact_threshold:
+                self._compact_event.set()
+        return shard.data
+
+    async def save_batch(self, users: dict, purchases: dict):
+        for group_id, group_users in users.items():
+            if str(group_id) not in self._shards:
+                await self.load_group(group_id)
+            shard = self._shards[str(group_id)]
+            await shard.append(group_users)
+            if shard.pending_entries >= self.compact_threshold:
+                self._compact_event.set()
+        if purchases:
+            await self._purchases.append(purchases)
+
+    async def list_groups(self) -> list:
+        return await asyncio.to_thread(self._list_group_ids)
+
+    async def evict_group(self, group_id: str):
+        group_id = str(group_id)
+        shard = self._shards.pop(group_id, None)
+        if shard is None:
+            return
+        task = asyncio.ensure_future(shard.close())
+        self._closing[group_id] = task
+        try:
+            await task
+        finally:
+            self._closing.pop(group_id, None)
+
+    async def close(self):
+        if self._compact_task:
+            # Python 3.11 及更早版本中，事件恰好已触发时 wait_for 会吞掉取消，
+            # 因此先设置停止标志并唤醒循环，取消只用于打断正在等待的合并
+            self._stopping = True
+            self._compact_event.set()
+            self._compact_task.cancel()
+            await asyncio.gather(self._compact_task, return_exceptions=True)
+            self._compact_task = None
+        for shard in list(self._shards.values()):
+            await shard.close()
+        if self._purchases:
+            await self._purchases.close()
+
+    async def read_all(self) -> tuple:
+        """读取全部数据但不改动任何文件，供迁移到其他后端时使用。"""
+        if not os.path.exists(os.path.join(self.shard_dir, self.MIGRATED_MARKER)):
+            if self.legacy_paths:
+                return await load_legacy_data(*self.legacy_paths)
+            return {}, {}
+        sign_data = {}
+        for group_id in self._list_group_ids():
+            sign_data[group_id] = await self._group_shard(group_id).load()
+        purchase_data = await self._purchase_shard().load()
+        return sign_data, purchase_data
+
+    def _record_recovery(self, shard: JournalShard):
+        recovery = shard.recovery
+        self.shard_loads += 1
+        self.recovery_total += recovery["seconds"]
+        self.recovery_max = max(self.recovery_max, recovery["seconds"])
+        if recovery["skipped"]:
+            self.recoveries += 1
+
+    def _list_group_ids(self) -> list:
+        names = set()
+        for file_name in os.listdir(self.shard_dir):
+            if file_name.startswith("."):
+                continue
+            name = file_name.split(".", 1)[0]
+            if name != self.PURCHASE_SHARD:
+                names.add(unquote(name))
+        return sorted(names)
+
+    def _shard_paths(self, name: str) -> tuple:
+        base = os.path.join(self.shard_dir, quote(name, safe=""))
+        return f"{base}.yml", f"{base}.journal"
+
+    def _group_shard(self, group_id: str) -> JournalShard:
+        snapshot_path, journal_path = self._shard_paths(group_id)
+        return JournalShard(
+            snapshot_path,
+            journal_path,
+            self.snapshot_format,
+            UserRecord.from_dict,
+            UserRecord.to_dict,
+            keep=self.keep_generations,
+        )
+
+    def _purchase_shard(self) -> JournalShard:
+        snapshot_path, journal_path = self._shard_paths(self.PURCHASE_SHARD)
+        return JournalShard(
+            snapshot_path,
+            journal_path,
+            self.snapshot_format,
+            int,
+            int,
+            keep=self.keep_generations,
+        )
+
+    async def _migrate_legacy(self):
+        marker = os.path.join(self.shard_dir, self.MIGRATED_MARKER)
+        if os.path.exists(marker):
+            return
+        imported = 0
+        if self.legacy_paths:
+            sign_data, purchase_data = await load_legacy_data(*self.legacy_paths)
+            for group_id, group_data in sign_data.items():
+                shard = self._group_shard(group_id)
+                await save_checkpoint(
+                    {uid: record.to_dict() for uid, record in group_data.items()},
+                    shard.snapshot_path,
+                    self.snapshot_format,
+                    generation=1,
+                    keep=self.keep_generations,
+                )
+                imported += len(group_data)
+            await save_checkpoint(
+                {uid: int(count) for uid, count in purchase_data.items()},
+                self._purchase_shard().snapshot_path,
+                self.snapshot_format,
+                generation=1,
+                keep=self.keep_generations,
+            )
+        async with aiofiles.open(marker, "w", encoding="utf-8") as f:
+            await f.write("1")
+        if imported:
+            logger.info(f"已将 {imported} 条签到记录拆分为按群存储的分片。")
+
+    async def _compact_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(
+                    self._compact_event.wait(), timeout=self.compact_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                return
+            self._compact_event.clear()
+            shards = [*self._shards.values(), self._purchases]
+            for shard in shards:
+                if self._stopping:
+                    return
+                if not shard.pending_entries:
+                    continue
+                try:
+                    await asyncio.shield(shard.compact())
+                except asyncio.CancelledError:
+                    return
+                except Exception as e:
+                    logger.error(f"合并签到日志失败 ({shard.journal_path}): {e}")
+
+
+class SqliteStore:
+    """基于 SQLite 的存储后端。
+
+    用户按 (group_id, user_id) 存为单独的行，变更只更新涉及的行；
+    群数据在首次访问时才读取，所有查询都在单独的工作线程中执行。
+    """
+
+    def __init__(self, db_path: str, legacy_source=None):
+        self.db_path = db_path
+        self.legacy_source = legacy_source
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="qsign-sqlite"
+        )
+        self._conn = None
+
+    @property
+    def stats(self) -> dict:
+        return {"backend": "sqlite"}
+
+    async def load(self) -> tuple:
+        await self._run(self._open)
+        if self.legacy_source is not None:
+            imported = await self.migrate_from_yaml(self.legacy_source)
+            if imported:
+                logger.info(f"已将 {imported} 条签到记录从 YAML 导入 SQLite。")
+        purchase_data = await self._run(self._read_purchase_counts)
+        return {}, purchase_data
+
+    async def load_group(self, group_id: str) -> dict:
+        return await self._run(self._read_group, str(group_id))
+
+    async def list_groups(self) -> list:
+        return await self._run(self._list_group_ids)
+
+    async def save_batch(self, users: dict, purchases: dict):
+        rows = [
+            (
+                str(group_id),
+                str(user_id),
+                record.coins,
+                record.bank,
+                json.dumps(list(record.contractors)),
+                record.contracted_by,
+                record.last_sign,
+                record.consecutive,
+            )
+            for group_id, group_users in users.items()
+            for user_id, record in group_users.items()
+        ]
+        purchase_rows = [(str(uid), count) for uid, count in purchases.items()]
+        await self._run(self._write_batch, rows, purchase_rows)
+
+    async def evict_group(self, group_id: str):
+        # 群数据每次都从数据库读取，没有需要释放的句柄
+        pass
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    async def migrate_from_yaml(self, source: ShardedStore) -> int:
+        """一次性导入文件后端的数据（及未合并的日志），导入后不再重复执行。"""
+        if await self._run(self._get_meta, "yaml_migrated"):
+            return 0
+        users, purchase_data = await source.read_all()
+        await self.save_batch(
+            users,
+            {uid: int(count) for uid, count in purchase_data.items()},
+        )
+        imported = sum(len(group_users) for group_users in users.values())
+        await self._run(self._set_meta, "yaml_migrated", "1")
+        return imported
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                group_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                coins REAL NOT NULL DEFAULT 0,
+                bank REAL NOT NULL DEFAULT 0,
+                contractors TEXT NOT NULL DEFAULT '[]',
+                contracted_by TEXT,
+                last_sign TEXT,
+                consecutive INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (group_id, user_id)
+            );
+            DROP INDEX IF EXISTS idx_users_wealth;
+            CREATE TABLE IF NOT EXISTS purchase_counts (
+                user_id TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+        if "wealth" in columns:
+            # 排行榜已改为内存中的有序索引，旧库里的总资产列不再读取
+            try:
+                conn.execute("ALTER TABLE users DROP COLUMN wealth")
+            except sqlite3.OperationalError as e:
+                # SQLite 3.35 之前不支持删除列，保留该列不影响读写
+                logger.info(f"保留旧的 wealth 列: {e}")
+        conn.commit()
+        self._conn = conn
+
+    def _read_purchase_counts(self) -> dict:
+        cursor = self._conn.execute("SELECT user_id, count FROM purchase_counts")
+        return {user_id: count for user_id, count in cursor}
+
+    def _list_group_ids(self) -> list:
+        rows = self._conn.execute("SELECT DISTINCT group_id FROM users").fetchall()
+        return [row[0] for row in rows]
+
+    def _read_group(self, group_id: str) -> dict:
+        cursor = self._conn.execute(
+            "SELECT user_id, coins, bank, contractors, contracted_by, last_sign,"
+            " consecutive FROM users WHERE group_id = ?",
+            (group_id,),
+        )
+        return {
+            user_id: UserRecord(
+                coins,
+                bank,
+                tuple(json.loads(contractors)),
+                contracted_by,
+                last_sign,
+                consecutive,
+            )
+            for (
+                user_id,
+                coins,
+                bank,
+                contractors,
+                contracted_by,
+                last_sign,
+                consecutive,
+            ) in cursor
+        }
+
+    def _write_batch(self, rows: list, purchase_rows: list):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO users (group_id, user_id, coins, bank,"
+                " contractors, contracted_by, last_sign, consecutive)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (group_id, user_id) DO UPDATE SET"
+                " coins = excluded.coins, bank = excluded.bank,"
+                " contractors = excluded.contractors,"
+                " contracted_by = excluded.contracted_by,"
+                " last_sign = excluded.last_sign,"
+                " consecutive = excluded.consecutive",
+                rows,
+            )
+            self._conn.executemany(
+                "INSERT INTO purchase_counts (user_id, count) VALUES (?, ?)"
+                " ON CONFLICT (user_id) DO UPDATE SET count = excluded.count",
+                purchase_rows,
+            )
+
+    def _get_meta(self, key: str):
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
@@ -0,0 +1,107 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class TransactionError(Exception):
+    """交易被拒绝，异常信息直接作为回复发给用户。"""
+
+
+class UserLocks:
+    """按 (群号, 用户) 划分的细粒度异步锁。
+
+    多方交易按固定顺序加锁以避免死锁；不再被引用的锁会被立即回收。
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    def holds_group(self, group_id: str) -> bool:
+        group_id = str(group_id)
+        return any(key[0] == group_id for key in self._locks)
+
+    @asynccontextmanager
+    async def hold(self, group_id: str, *user_ids: str):
+        keys = sorted({(str(group_id), str(uid)) for uid in user_ids if uid})
+        referenced = []
+        acquired = []
+        try:
+            for key in keys:
+                entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+                entry[1] += 1
+                referenced.append(key)
+                await entry[0].acquire()
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self._locks[key][0].release()
+            for key in referenced:
+                entry = self._locks[key]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+
+class Transaction:
+    """暂存一组修改，校验通过后一次性全部应用。
+
+    在 with 块内抛出异常或校验失败时，任何修改都不会生效。
+    """
+
+    def __init__(self):
+        self._ops = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def add(self, target, key: str, delta: float, minimum: float = None):
+        self._ops.append(("add", target, key, delta, minimum))
+
+    def set(self, target, key: str, value):
+        self._ops.append(("set", target, key, value, None))
+
+    def append(self, target, key: str, item):
+        self._ops.append(("append", target, key, item, None))
+
+    def discard(self, target, key: str, item):
+        self._ops.append(("discard", target, key, item, None))
+
+    def commit(self):
+        staged = {}
+        for op, target, key, value, minimum in self._ops:
+            slot = (id(target), key)
+            current = staged[slot][2] if slot in staged else _get(target, key)
+            if op == "add":
+                current = (current or 0) + value
+                if minimum is not None and current < minimum - 1e-9:
+                    raise TransactionError("余额不足，交易已取消。")
+            elif op == "set":
+                current = value
+            elif op == "append":
+                current = tuple(current or ()) + (value,)
+            elif op == "discard":
+                current = tuple(item for item in current or () if item != value)
+            staged[slot] = (target, key, current)
+
+        for target, key, value in staged.values():
+            _set(target, key, value)
+        self._ops.clear()
+
+
+def _get(target, key: str):
+    # 既支持 UserRecord 的属性，也支持 purchase_data 这样的普通 dict
+    if isinstance(target, dict):
+        return target.get(key)
+    return getattr(target, key)
+
+
+def _set(target, key: str, value):
+    if isinstance(target, dict):
+        target[key] = value
+    else:
+        setattr(target, key, value)
@@ -0,0 +1,52 @@
+from bisect import bisect_right
+
+
+class Valuation:
+    """身价档位与身价的计算规则。
+
+    相关配置在构造时读取一次；插件重载配置时会重新构造。记录上只缓存档位序号，
+    使用前先核对总资产仍落在该档位的区间内，旧规则留下的序号不会被误用。
+    """
+
+    def __init__(
+        self,
+        levels: list,
+        base_values: dict,
+        price_bonus: float = 0.15,
+        rate_bonus: float = 0.075,
+    ):
+        self.levels = levels
+        self.price_bonus = price_bonus
+        self.rate_bonus = rate_bonus
+        self._thresholds = [min_coin for min_coin, _, _ in levels]
+        self._names = [name for _, name, _ in levels]
+        self._rates = [rate for _, _, rate in levels]
+        self._base_values = [base_values[name] for name in self._names]
+        # 各档位的资产区间 [下限, 上限)，最低档不设下限
+        self._lower = [float("-inf"), *self._thresholds[1:]]
+        self._upper = [*self._thresholds[1:], float("inf")]
+
+    def derive(self, record, purchases: int) -> tuple:
+        """返回 (总资产, 档位名, 档位加成, 身价)。
+
+        档位序号缓存在记录上，只有资产跨出当前档位后才重新查找。
+        """
+        total = record.coins + record.bank
+        tier = record.tier
+        if (
+            tier is None
+            or tier >= len(self._lower)
+            or not self._lower[tier] <= total < self._upper[tier]
+        ):
+            tier = max(0, bisect_right(self._thresholds, total) - 1)
+            record.tier = tier
+        return (
+            total,
+            self._names[tier],
+            self._rates[tier],
+            self._base_values[tier] * (1 + purchases * self.price_bonus),
+        )
+
+    def contractor_rate(self, record, purchases: int) -> float:
+        """一名雇员为雇主提供的收益加成。"""
+        return self.derive(record, purchases)[2] + purchases * self.rate_bonus